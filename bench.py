@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+# ------------------------------------------------------------------------------
+#
+# WHO
+#
+#  km@grogg.org
+#
+# WHAT
+#
+#  Offline benchmarks of the scrape and sync hot paths. Cinemateket pages are
+#  generated from the HTML fixtures and served from a local web server, and
+#  the Google calendar is replaced by the in-memory fakecal transport.
+#
+#  Reports wall time, request counts and peak memory per benchmark and size,
+#  optionally as JSON, and compares against an earlier JSON report to catch
+#  regressions.
+#
+# ------------------------------------------------------------------------------
+
+import argparse
+import contextlib
+import datetime
+import functools
+import http.server
+import io
+import json
+import os
+import platform
+import re
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+import cine2cal
+from cinemateket import Cinemateket, Movie, Screening
+import dcal
+from dcal import CineCal
+import extract
+from fakecal import FakeCalendarHttp
+from fetch import Fetcher
+from mirror import CalendarMirror
+
+# ------------------------------------------------------------------------------
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'fixtures')
+THEATERS = ['Bio Victor', 'Bio Mauritz', 'Bio Klara', 'Filmhuset']
+WEEKDAYS = ['mån', 'tis', 'ons', 'tor', 'fre', 'lör', 'sön']
+
+# Entry points timed at startup and the heavy modules they must not import
+# before they are needed
+STARTUP = ['cine2cal', 'cinemateket']
+LAZY = ['dateutil', 'google', 'googleapiclient', 'google_auth_oauthlib',
+        'halo', 'tabulate']
+IMPORTTIME = re.compile(r'import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)')
+
+
+def _template(name: str) -> string.Template:
+    with open(os.path.join(FIXTURES, name), 'r', encoding='utf-8') as stream:
+        return string.Template(stream.read())
+
+
+class Program():
+    """A generated Cinemateket program of screenings, each film is shown
+    about three times."""
+
+    def __init__(self, screenings: int, page_size: int = 20) -> None:
+
+        self.screenings: int = screenings
+        self.films: int = max(1, screenings // 3)
+        self.page_size: int = page_size
+        self.first = datetime.datetime.now().replace(
+            hour=0, minute=0, second=0, microsecond=0) + \
+            datetime.timedelta(days=1)
+
+        self._program = _template('program.html')
+        self._article = _template('article.html')
+        self._movie = _template('movie.html')
+
+# ------------------------------------------------------------------------------
+
+    def index(self, page: int) -> str:
+        """Program index page"""
+
+        articles = []
+        for i in range((page - 1) * self.page_size,
+                       min(self.screenings, page * self.page_size)):
+            film = i % self.films
+            start = self.first + datetime.timedelta(days=i // 6,
+                                                    hours=12 + 2 * (i % 6))
+            articles.append(self._article.substitute(
+                link=f'/sv/film/{film}/',
+                slug=f'film-{film}',
+                title=f'Film nummer {film} – del {film % 3 + 1}',
+                when=f'{WEEKDAYS[start.weekday()]} '
+                     f'{start.strftime('%d/%m kl. %H:%M')}',
+                theater=THEATERS[i % len(THEATERS)]))
+
+        return self._program.substitute(articles=''.join(articles))
+
+# ------------------------------------------------------------------------------
+
+    def movie(self, film: int) -> str:
+        """Movie detail page"""
+
+        return self._movie.substitute(title=f'Film nummer {film}',
+                                      year=1920 + film % 100,
+                                      hours=1 + film % 2,
+                                      minutes=film % 60)
+
+
+# ------------------------------------------------------------------------------
+
+class ProgramServer(http.server.ThreadingHTTPServer):
+    """Local web server for a generated program, counts requests"""
+
+    daemon_threads = True
+
+    def __init__(self, program: Program) -> None:
+
+        self.program: Program = program
+        self.requests: int = 0
+        self.bytes: int = 0
+        self.paths: set[str] = set()
+        self._lock = threading.Lock()
+
+        super().__init__(('127.0.0.1', 0), _ProgramHandler)
+        self.url: str = f'http://127.0.0.1:{self.server_port}'
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+# ------------------------------------------------------------------------------
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.bytes = 0
+            self.paths.clear()
+
+# ------------------------------------------------------------------------------
+
+    @property
+    def duplicates(self) -> int:
+        """Requests for a page that was already served"""
+
+        return self.requests - len(self.paths)
+
+
+class _ProgramHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        program = self.server.program  # type: ignore
+
+        if '/program/' in url.path:
+            page = int(parse_qs(url.query).get('page', ['1'])[0])
+            body = program.index(page).encode()
+        elif match := re.search(r'/film/(\d+)/', url.path):
+            body = program.movie(int(match.group(1))).encode()
+        else:
+            self.send_error(404)
+            return
+
+        with self.server._lock:  # type: ignore
+            self.server.requests += 1  # type: ignore
+            self.server.bytes += len(body)  # type: ignore
+            self.server.paths.add(self.path)  # type: ignore
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+# ------------------------------------------------------------------------------
+
+class Bench():
+    """Run benchmarks against a local program server and fake calendar"""
+
+    def __init__(self, memory: bool = True) -> None:
+        self.memory: bool = memory
+        self.results: list[dict] = []
+        self.tmp = tempfile.TemporaryDirectory(prefix='cine2cal-bench-')
+
+# ------------------------------------------------------------------------------
+
+    def _args(self, size: int, **kwargs) -> argparse.Namespace:
+        """Command line arguments for a run over size screenings"""
+
+        args = argparse.Namespace(
+            batch_size=50, cache_dir=os.path.join(self.tmp.name, 'cache'),
+            calendar_rate=0.0, concurrency=8, delete=0, dry_run=False,
+            engine='threads',
+            mirror=os.path.join(self.tmp.name, 'mirror.json'), movies=size,
+            no_cache=True, no_mirror=True, no_program=True, no_state=True,
+            notifications=False, pages=size, profile=False, profile_json=None,
+            profile_prom=None,
+            program=os.path.join(self.tmp.name, 'program.sqlite'),
+            query=None, queue_size=64, rate=0.0,
+            state=os.path.join(self.tmp.name, 'state.sqlite'), stream=False,
+            targets=None, until=None, verbose=False)
+        vars(args).update(kwargs)
+        return args
+
+# ------------------------------------------------------------------------------
+
+    def _measure(self, name: str, size: int, setup, run,
+                 server: ProgramServer | None = None) -> dict:
+        """Time run(*setup()) and trace its peak memory in a second run"""
+
+        calendar = FakeCalendarHttp()
+        if server:
+            server.reset()
+
+        # Halo and the event printouts are not part of the benchmark
+        with contextlib.redirect_stdout(io.StringIO()):
+            state = setup(calendar)
+            start = time.perf_counter()
+            run(*state)
+            seconds = time.perf_counter() - start
+
+            result = {
+                'name': name,
+                'size': size,
+                'seconds': round(seconds, 4),
+                'http_requests': server.requests if server else 0,
+                'http_bytes': server.bytes if server else 0,
+                'http_duplicates': server.duplicates if server else 0,
+                'calendar_requests': calendar.requests,
+                'calendar_calls': calendar.calls,
+            }
+
+            if self.memory:
+                state = setup(FakeCalendarHttp())
+                tracemalloc.start()
+                run(*state)
+                result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+        self.results.append(result)
+        return result
+
+# ------------------------------------------------------------------------------
+
+    def run(self, sizes: list[int]) -> list[dict]:
+        """Run all benchmarks for each size"""
+
+        self._startup()
+
+        for size in sizes:
+            program = Program(size)
+            server = ProgramServer(program)
+
+            with mock.patch.object(Cinemateket, 'site', server.url):
+                self._scrape(size, server)
+                movies = Cinemateket(self._args(size),
+                                     fetcher=Fetcher(concurrency=8)).list()
+                self._parse(size, program)
+                self._calendar(size, movies)
+                self._main(size, server)
+
+            server.shutdown()
+            server.server_close()
+
+        return self.results
+
+# ------------------------------------------------------------------------------
+
+    def _startup(self, runs: int = 5) -> None:
+        """Import time of the entry points in a fresh interpreter, the best
+        of runs. Loading any of the LAZY modules is reported as an
+        error."""
+
+        for module in STARTUP:
+            seconds = []
+            for _ in range(runs):
+                output = subprocess.run(
+                    [sys.executable, '-X', 'importtime', '-c',
+                     f'import {module}'],
+                    cwd=os.path.dirname(os.path.abspath(__file__)),
+                    capture_output=True, text=True, check=True).stderr
+
+                imports = [match.groups() for match in
+                           map(IMPORTTIME.match, output.splitlines())
+                           if match]
+                seconds.append(next(int(us) for us, indent, name in imports
+                                    if name == module and not indent) / 1e6)
+
+            loaded = sorted({name.split('.')[0] for _, _, name in imports}
+                            .intersection(LAZY))
+            self.results.append({
+                'name': f'startup {module}',
+                'size': 0,
+                'seconds': round(min(seconds), 4),
+                'http_requests': 0,
+                'http_bytes': 0,
+                'http_duplicates': 0,
+                'calendar_requests': 0,
+                'calendar_calls': 0,
+                'imports': len(imports),
+                'eager_imports': loaded,
+            })
+
+# ------------------------------------------------------------------------------
+
+    def _scrape(self, size: int, server: ProgramServer) -> None:
+        """Crawl the program and fetch and parse every movie page"""
+
+        self._measure(
+            'scrape', size,
+            lambda calendar: (Cinemateket(self._args(size), lazy=True),),
+            lambda cinemateket: cinemateket._import_movies(size),
+            server)
+        self._measure(
+            'scrape.parse_workers', size,
+            lambda calendar: (Cinemateket(self._args(size, parse_workers=2),
+                                          lazy=True),),
+            lambda cinemateket: cinemateket._import_movies(size),
+            server)
+
+# ------------------------------------------------------------------------------
+
+    def _parse(self, size: int, program: Program) -> None:
+        """Parse the index and movie pages without any network"""
+
+        pages = [program.index(page) for page in
+                 range(1, size // program.page_size + 2)]
+        movies = [program.movie(i % program.films) for i in range(size)]
+        when = datetime.datetime.now()
+
+        def parse(cinemateket: Cinemateket) -> None:
+            for page in pages:
+                for article in extract.articles(page):
+                    cinemateket._parse_article(article)
+            for html in movies:
+                details = cinemateket._get_details(html)
+                Screening.create('Film', '/film/', when, 'Bio', *details)
+
+        self._measure(
+            'parse', size,
+            lambda calendar: (Cinemateket(self._args(size), lazy=True),),
+            parse)
+
+# ------------------------------------------------------------------------------
+
+    def _calendar(self, size: int, movies: list[Movie]) -> None:
+        """Calendar lookups, inserts and deletes"""
+
+        def cinecal(calendar: FakeCalendarHttp, populate: bool = False,
+                    past: bool = False) -> CineCal:
+            cal = CineCal(self._args(size), http=calendar)
+            shift = datetime.timedelta(
+                days=(movies[-1].start - movies[0].start).days + 2) \
+                if past else datetime.timedelta()
+            if populate:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    cal.insert_many([
+                        Screening(film=m.film, start=m.start - shift,
+                                  theater_id=m.theater_id) for m in movies])
+                calendar.requests = calendar.calls = 0
+            return cal
+
+        self._measure(
+            'calendar.get', size,
+            lambda calendar: (cinecal(calendar, populate=True),),
+            lambda cal: [cal.get(m.start, m.name) for m in movies])
+        self._measure(
+            'calendar.index', size,
+            lambda calendar: (cinecal(calendar, populate=True),),
+            lambda cal: cal.index(movies[0].start, movies[-1].start))
+        self._measure(
+            'calendar.insert', size,
+            lambda calendar: (cinecal(calendar),),
+            lambda cal: cal.insert_many(movies))
+
+        def mirror(calendar: FakeCalendarHttp, synced: bool) -> tuple:
+            cal = cinecal(calendar, populate=True)
+            path = os.path.join(self.tmp.name, f'mirror-{size}.json')
+            if os.path.exists(path):
+                os.remove(path)
+            cal.mirror = CalendarMirror(cal, path)
+            if synced:
+                cal.mirror.sync()
+                cal.patch_many([(event_id, movies[0]) for event_id in
+                                list(calendar.events)[:max(1, size // 10)]])
+                calendar.requests = calendar.calls = 0
+            return (cal.mirror,)
+
+        self._measure(
+            'calendar.mirror.full', size,
+            lambda calendar: mirror(calendar, synced=False),
+            lambda mirror: mirror.sync())
+        self._measure(
+            'calendar.mirror.sync', size,
+            lambda calendar: mirror(calendar, synced=True),
+            lambda mirror: mirror.sync())
+        self._measure(
+            'calendar.delete_days', size,
+            lambda calendar: (cinecal(calendar, populate=True, past=True),),
+            lambda cal: cal.delete_days(
+                0 - (movies[-1].start - movies[0].start).days - 4))
+
+# ------------------------------------------------------------------------------
+
+    def _main(self, size: int, server: ProgramServer) -> None:
+        """End-to-end run of cine2cal"""
+
+        def setup(calendar: FakeCalendarHttp) -> tuple:
+            return (self._args(size),
+                    functools.partial(CineCal, http=calendar))
+
+        def run(args: argparse.Namespace, cinecal) -> None:
+            with mock.patch.object(dcal, 'CineCal', cinecal):
+                cine2cal.main(args)
+
+        self._measure('main', size, setup, run, server)
+
+
+# ------------------------------------------------------------------------------
+
+def _print(results: list[dict]) -> None:
+    """Print results as a table"""
+
+    print(f'{'benchmark':<22}{'size':>6}{'seconds':>10}{'http':>7}'
+          f'{'calendar':>10}{'peak MB':>9}')
+    for r in results:
+        memory = f'{r['peak_memory'] / 2 ** 20:.1f}' \
+            if 'peak_memory' in r else '-'
+        print(f'{r['name']:<22}{r['size']:>6}{r['seconds']:>10.3f}'
+              f'{r['http_requests']:>7}{r['calendar_requests']:>10}'
+              f'{memory:>9}')
+
+# ------------------------------------------------------------------------------
+
+
+def _compare(results: list[dict], baseline_file: str,
+             tolerance: float) -> list[str]:
+    """Compare results with a baseline report and return regressions"""
+
+    with open(baseline_file, 'r') as stream:
+        baseline = {(r['name'], r['size']): r
+                    for r in json.load(stream)['results']}
+
+    regressions = []
+    for r in results:
+        old = baseline.get((r['name'], r['size']))
+        if not old:
+            continue
+        for key in ('seconds', 'http_requests', 'http_duplicates',
+                    'calendar_requests', 'peak_memory', 'imports'):
+            if key in r and key in old and \
+                    r[key] > old[key] * (1 + tolerance) and \
+                    (key != 'seconds' or r[key] - old[key] > 0.05):
+                regressions.append(f'{r['name']} {r['size']}: {key} '
+                                   f'{old[key]} -> {r[key]}')
+
+    return regressions
+
+# ------------------------------------------------------------------------------
+
+
+def main(args: argparse.Namespace) -> None:
+
+    bench = Bench(memory=not args.no_memory)
+    results = bench.run(args.sizes)
+    _print(results)
+
+    report = {
+        'python': platform.python_version(),
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as stream:
+            json.dump(report, stream, indent=2)
+
+    regressions = [f'{r['name']}: imports {', '.join(r['eager_imports'])}'
+                   for r in results if r.get('eager_imports')]
+    if args.baseline:
+        regressions += _compare(results, args.baseline, args.tolerance)
+    for regression in regressions:
+        sys.stderr.write(f'Regression: {regression}\n')
+    if regressions:
+        sys.exit(1)
+
+# ------------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='bench')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='JSON report to compare against.')
+    parser.add_argument('--json', '-j', type=str, default=None,
+                        help='Write a JSON report to this file.')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='Don\'t trace peak memory.')
+    parser.add_argument('--sizes', '-s', type=int, nargs='+',
+                        default=[20, 200, 2000],
+                        help='Number of screenings to benchmark.')
+    parser.add_argument('--tolerance', '-t', type=float, default=0.25,
+                        help='Allowed relative regression.')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,160 @@
+# -----------------------------------------------------------------------------
+
+from dataclasses import dataclass, asdict
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+# -----------------------------------------------------------------------------
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'cine2cal')
+
+
+@dataclass
+class CacheEntry:
+    url: str
+    body: str
+    etag: str | None
+    last_modified: str | None
+    fetched: float
+
+
+class PageCache():
+    """On-disk cache of fetched pages keyed by URL.
+
+    Entries younger than ttl seconds are served without a request, older
+    entries are revalidated with If-None-Match/If-Modified-Since. Entries
+    unused for expire seconds are evicted, as are the least recently used
+    entries when the cache grows beyond max_size bytes."""
+
+    def __init__(self,
+                 directory: str = os.path.join(CACHE_DIR, 'pages'),
+                 ttl: float = 24 * 3600,
+                 expire: float = 30 * 24 * 3600,
+                 max_size: int = 64 * 1024 * 1024,
+                 verbose: bool = False) -> None:
+
+        self.directory: str = directory
+        self.ttl: float = ttl
+        self.expire: float = expire
+        self.max_size: int = max_size
+        self.verbose: bool = verbose
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.prune()
+
+# -----------------------------------------------------------------------------
+
+    def _path(self, url: str) -> str:
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.directory, f'{key}.json')
+
+# -----------------------------------------------------------------------------
+
+    def get(self, url: str) -> CacheEntry | None:
+        """Get the cached entry for url, if any"""
+
+        path = self._path(url)
+        try:
+            with open(path, 'r') as stream:
+                entry = CacheEntry(**json.load(stream))
+            # Touch the file to keep track of recently used entries
+            os.utime(path)
+        except (OSError, ValueError, TypeError):
+            return None
+
+        return entry if entry.url == url else None
+
+# -----------------------------------------------------------------------------
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        """Check if an entry may be used without revalidation"""
+
+        return time.time() - entry.fetched < self.ttl
+
+# -----------------------------------------------------------------------------
+
+    @staticmethod
+    def validators(entry: CacheEntry | None) -> dict[str, str]:
+        """Conditional request headers for revalidating an entry"""
+
+        headers = {}
+        if entry and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry and entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+# -----------------------------------------------------------------------------
+
+    def put(self, url: str, body: str, headers) -> None:
+        """Store a page with the validators from its response headers"""
+
+        self._write(CacheEntry(url=url,
+                               body=body,
+                               etag=headers.get('ETag'),
+                               last_modified=headers.get('Last-Modified'),
+                               fetched=time.time()))
+
+# -----------------------------------------------------------------------------
+
+    def revalidated(self, entry: CacheEntry) -> None:
+        """Mark an entry as fresh after a 304 Not Modified response"""
+
+        entry.fetched = time.time()
+        self._write(entry)
+
+# -----------------------------------------------------------------------------
+
+    def _write(self, entry: CacheEntry) -> None:
+        """Atomically write an entry to disk"""
+
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as stream:
+                json.dump(asdict(entry), stream)
+            os.replace(tmp, self._path(entry.url))
+        except OSError as e:
+            sys.stderr.write(f'Failed to cache {entry.url}: {e}\n')
+
+# -----------------------------------------------------------------------------
+
+    def prune(self) -> int:
+        """Evict expired entries and the least recently used entries above
+        max_size.
+
+        Returns:
+            number of evicted entries.
+        """
+
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        # Most recently used first
+        entries.sort(reverse=True)
+
+        now = time.time()
+        size = 0
+        evicted = 0
+        for mtime, file_size, path in entries:
+            size += file_size
+            if now - mtime > self.expire or size > self.max_size:
+                try:
+                    os.remove(path)
+                    evicted += 1
+                except OSError:
+                    pass
+
+        if self.verbose and evicted:
+            print(f'Evicted {evicted} pages from {self.directory}')
+
+        return evicted
@@ -10,70 +10,409 @@
 #  Parse Cinemateket page of upcoming movies and insert them into a Google
 #  calendar. Uses cinemateket and dcal modules.
 #
-# TODO
-#
-#  - Calendar entry check only checks the first event in that time slot which
-#    means that it will return false if the first event is not a CINEMATEKET
-#    event.
-#
 #
 # ------------------------------------------------------------------------------
 
+from __future__ import annotations
 import argparse
+from collections.abc import Callable
+import concurrent.futures
+import cProfile
+from datetime import date, datetime, time, timedelta
+import functools
+import os
+import queue
+import random
+import signal
 import sys
+from threading import Event, Lock, Thread
+from typing import TYPE_CHECKING
 
-from cinemateket import Cinemateket
-from dcal import CineCal
+from cinemateket import Movie
+from fetch import Fetcher, make_fetcher
+from metrics import metrics
+from program import PROGRAM_FILE, ProgramDB
+from reconcile import Reconciler
+from source import Source, make_source
+from state import STATE_FILE, SyncState
+from targets import Target, load_targets
 
+# The Google API client is slow to import and only loaded once the calendar
+# is needed
+if TYPE_CHECKING:
+    from dcal import CineCal
+    from ics import IcsFeed
+
+# Serializes the output of targets synced concurrently
+_output = Lock()
 
 # ------------------------------------------------------------------------------
 
 def main(args: argparse.Namespace) -> None:
     """Main function to sync Cinemateket movies to calendar"""
 
+    watch = getattr(args, 'watch', 0)
+    stop = Event()
+    if watch:
+        _handle_signals(stop)
+
+    fetcher = None
+    server = None
     try:
-        # Get movies from cinemateket
-        cinemateket = Cinemateket(args)
+        # A stored query is synced from the program database instead of
+        # scraping
+        if getattr(args, 'query', None) and not getattr(args, 'source', None):
+            args.source = ['program']
+
+        # A feed file to write instead of syncing calendars, optionally
+        # served over HTTP while watching
+        feed = None
+        if getattr(args, 'ics', None):
+            from ics import FeedServer, IcsFeed
+            feed = IcsFeed(args.ics)
+            if getattr(args, 'ics_port', None):
+                server = FeedServer(args.ics, args.ics_port)
+                server.start()
+                print(f'Serving {server.url}')
+
+        # The calendars to sync, each with the screenings synced to it by
+        # earlier runs
+        targets: list[Target] = []
+        if not feed:
+            targets = load_targets(args.targets) \
+                if getattr(args, 'targets', None) else [Target()]
+        for target in targets:
+            target.state = None if args.no_state else \
+                SyncState(target.path(args.state))
+
+        # The page fetcher and the calendar services are kept across the
+        # cycles of watch mode
+        fetcher = make_fetcher(args)
+
+        while not stop.is_set():
+            try:
+                _run(args, fetcher, targets, stop, feed)
+            except Exception as e:
+                if not watch:
+                    raise
+                sys.stderr.write(f'Error occurred: {e}\n')
+
+            if not watch:
+                break
+
+            # Each report covers one cycle
+            _report(args)
+            metrics.reset()
+            delay = _next_delay(watch, getattr(args, 'jitter', 0.1))
+            if args.verbose:
+                print(f'Next run in {delay:.0f}s')
+            stop.wait(delay)
+
+    except Exception as e:
+        sys.stderr.write(f'Error occurred: {e}\n')
+        sys.exit(-1)
+
+    finally:
+        if fetcher:
+            fetcher.close()
+        if server:
+            server.shutdown()
+            server.server_close()
+        if not watch:
+            _report(args)
+
+# ------------------------------------------------------------------------------
+
+
+def _run(args: argparse.Namespace, fetcher: Fetcher, targets: list[Target],
+         stop: Event, feed: IcsFeed | None = None) -> None:
+    """Scrape once and sync the program to every target, or write it to the
+    feed. Once stop is set the scrape ends early and what has been scraped
+    so far is synced. Dry runs print the planned calendar changes instead
+    of making them.
+
+    A single target may be synced while scraping, several targets are
+    synced concurrently once the scrape is done."""
+
+    fan_out = len(targets) > 1
+    stream = args.stream and len(targets) == 1
+
+    # Get movies from the sources, in streaming mode they are synced to
+    # the calendar while being scraped. The state store of a single target
+    # saves fetching the pages of screenings already synced.
+    with metrics.timer('scrape'):
+        source = make_source(
+            args, fetcher=fetcher,
+            state=targets[0].state if len(targets) == 1 else None,
+            lazy=stream, stop=stop)
+    if not stream:
+        print()
+        source.print()
+        print()
+        _store(args, source)
+
+    # The feed is written without the calendar API
+    if feed:
+        with metrics.timer('export'):
+            counts = feed.update(source.list(), save=not args.dry_run)
+        print(f'Added {counts['added']}, changed {counts['changed']}, '
+              f'removed {counts['removed']} and kept {counts['unchanged']} '
+              f'events in {feed.path}.')
+        return
+
+    # Connect to Google calendar, one target at a time as they share the
+    # OAuth token
+    for target in targets:
+        if target.cinecal is None:
+            _connect(args, target)
+
+    with metrics.timer('sync'):
+        if not fan_out:
+            _sync_target(args, source, targets[0], stream)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=len(targets)) as executor:
+                for target, error in zip(targets, executor.map(
+                        functools.partial(_try_sync_target, args,
+                                          source), targets)):
+                    if error:
+                        sys.stderr.write(f'Failed to sync {target.name}: '
+                                         f'{error}\n')
+
+    if stream:
         print()
-        cinemateket.print()
+        source.print()
         print()
+        _store(args, source)
+
+# ------------------------------------------------------------------------------
+
+
+def _store(args: argparse.Namespace, source: Source) -> None:
+    """Keep the scraped program in the program database for queries"""
+
+    if getattr(args, 'no_program', True) or source.name == 'program' or \
+            not source.window:
+        return
+
+    db = ProgramDB(args.program)
+    try:
+        db.store(source.list(), source.window, source.unresolved)
+    finally:
+        db.close()
+
+# ------------------------------------------------------------------------------
+
 
-        # Connect to Google calendar
-        cinecal = CineCal(args)
+def _connect(args: argparse.Namespace, target: Target) -> None:
+    """Connect a target to its calendar"""
 
-        # Delete the past
-        deleted_count = cinecal.delete_days(0 - args.delete)
-        print(f'Deleted {deleted_count} events.')
+    from dcal import CineCal
+    cinecal = target.cinecal = CineCal(args, attendees=target.attendees,
+                                       calendar_id=target.calendar,
+                                       rate=target.rate)
 
-        # Insert new events
+    # Stamp events from before screening keys with their key, once
+    if getattr(args, 'migrate_keys', False):
+        now = datetime.now()
+        migrated = cinecal.migrate_keys(now - timedelta(days=365),
+                                        now + timedelta(days=365))
+        print(f'{_prefix(target)}Added screening keys to {migrated} events.')
+
+    # Read the calendar from a local mirror kept up to date with
+    # incremental syncs
+    if not getattr(args, 'no_mirror', True):
+        from mirror import MIRROR_FILE, CalendarMirror
+        cinecal.mirror = CalendarMirror(
+            cinecal, target.path(args.mirror or MIRROR_FILE))
+
+# ------------------------------------------------------------------------------
+
+
+def _prefix(target: Target) -> str:
+    return f'{target.name}: ' if target.name else ''
+
+# ------------------------------------------------------------------------------
+
+
+def _try_sync_target(args: argparse.Namespace, source: Source,
+                     target: Target) -> Exception | None:
+    """Sync a target and return the error if it failed"""
+
+    try:
+        _sync_target(args, source, target)
+    except Exception as e:
+        return e
+    return None
+
+# ------------------------------------------------------------------------------
+
+
+def _sync_target(args: argparse.Namespace, source: Source,
+                 target: Target, stream: bool = False) -> None:
+    """Sync the screenings of a target to its calendar"""
+
+    cinecal: CineCal = target.cinecal  # type: ignore
+    cinecal.stats = dict.fromkeys(cinecal.stats, 0)
+    cinecal.refresh_credentials()
+    if cinecal.mirror:
+        cinecal.mirror.sync()
+
+    reconciler = Reconciler(cinecal, None if args.dry_run else target.state)
+
+    # Delete the past
+    if not args.dry_run:
+        cinecal.delete_days(0 - args.delete)
+
+    # Insert, patch and delete events
+    if stream:
+        _sync_stream(source, reconciler, args.queue_size, args.dry_run,
+                     target.wants)
+    elif source.window:
+        _sync_events([movie for movie in source.list()
+                      if target.wants(movie)],
+                     source.window, reconciler, args.dry_run,
+                     source.unresolved)
+
+    if target.state and not args.dry_run:
+        target.state.commit()
+
+    # Targets synced concurrently print one at a time
+    with _output:
         if args.dry_run:
+            if target.name:
+                print(f'{target.name}:')
+            reconciler.take().print()
             return
 
-        num_events = _sync_events(cinemateket, cinecal)
-        print(f'Inserted {num_events} events.')
+        print(f'{_prefix(target)}Inserted {cinecal.stats['inserted']}, '
+              f'updated {cinecal.stats['updated']}, deleted '
+              f'{cinecal.stats['deleted']} and failed '
+              f'{cinecal.stats['failed']} events.')
 
-    except Exception as e:
-        sys.stderr.write(f'Error occurred: {e}\n')
-        sys.exit(-1)
+# ------------------------------------------------------------------------------
+
+
+def _handle_signals(stop: Event) -> None:
+    """Stop gracefully on the first SIGINT or SIGTERM by setting stop, the
+    current run is finished first. A second signal interrupts at once."""
+
+    def handler(signum, frame):
+        if stop.is_set():
+            raise KeyboardInterrupt
+        sys.stderr.write(f'{signal.Signals(signum).name} received, '
+                         'stopping after the current run\n')
+        stop.set()
+
+    signal.signal(signal.SIGINT, handler)
+    signal.signal(signal.SIGTERM, handler)
 
 # ------------------------------------------------------------------------------
 
 
-def _sync_events(cinemateket: Cinemateket, cinecal: CineCal) -> int:
-    """Sync movies to calendar and return number of inserted events"""
-    num_events = 0
-    for movie in cinemateket.list():
-        try:
-            # Get all events in this time slot
-            event = cinecal.get(movie.start, movie.name)
+def _next_delay(interval: float, jitter: float) -> float:
+    """Seconds to the next run, interval spread by +-jitter so that runs
+    don't line up with other clients polling on the same schedule"""
 
-            if not event:
-                cinecal.insert(movie)
-                num_events += 1
+    return max(0.0, interval * (1 + random.uniform(-jitter, jitter)))
+
+# ------------------------------------------------------------------------------
+
+
+def _report(args: argparse.Namespace) -> None:
+    """Print and export the per-phase metrics of the run"""
+
+    if args.profile:
+        print()
+        print(metrics.table())
+        print()
+
+    for path, text in ((args.profile_json, metrics.json),
+                       (args.profile_prom, metrics.prometheus)):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text())
+
+# ------------------------------------------------------------------------------
+
+
+def _sync_events(movies: list[Movie],
+                 window: tuple[datetime, datetime],
+                 reconciler: Reconciler, dry_run: bool = False,
+                 unresolved: set[str] | None = None) -> None:
+    """Sync movies to the calendar. All tagged events in the program window
+    are fetched once and compared to the movies, then the changes are made
+    in batches. The events of movie links in unresolved are not deleted."""
+
+    reconciler.index(*window)
+    for movie in movies:
+        reconciler.add(movie)
+    reconciler.finish(*window, unresolved)
+
+    if not dry_run:
+        reconciler.apply(reconciler.take())
+
+# ------------------------------------------------------------------------------
+
+
+def _sync_stream(source: Source, reconciler: Reconciler,
+                 queue_size: int = 64, dry_run: bool = False,
+                 wants: Callable[[Movie], bool] = lambda movie: True) -> None:
+    """Sync movies to the calendar while they are being scraped.
+
+    The scraper runs in its own thread and hands movies over through a
+    bounded queue. Changes are made a batch at a time. Movies that may
+    have moved are matched, and events of screenings that have disappeared
+    are deleted, once the scrape is done."""
+
+    movies: queue.Queue = queue.Queue(maxsize=queue_size)
+    errors: list[Exception] = []
+
+    def produce():
+        try:
+            for movie in source.iter_movies():
+                movies.put(movie)
         except Exception as e:
-            sys.stderr.write(f'Failed to sync movie {movie.name}: {e}\n')
+            errors.append(e)
+        finally:
+            movies.put(None)
+
+    Thread(target=produce, daemon=True).start()
+
+    indexed: tuple[date, date] | None = None
+    batch_size = reconciler.cinecal.batch_size
 
-    return num_events
+    while (movie := movies.get()) is not None:
+
+        # Index the calendar for the days of the program window found so
+        # far that have not been indexed yet
+        first, last = source.window  # type: ignore
+        if not indexed:
+            reconciler.index(first, last)
+            indexed = (first.date(), last.date())
+        elif movie.start.date() > indexed[1]:
+            reconciler.index(
+                datetime.combine(indexed[1] + timedelta(days=1), time()),
+                last)
+            indexed = (indexed[0], last.date())
+        elif movie.start.date() < indexed[0]:
+            reconciler.index(
+                first, datetime.combine(indexed[0] - timedelta(days=1),
+                                        time()))
+            indexed = (first.date(), indexed[1])
+
+        if wants(movie):
+            reconciler.add(movie)
+        if not dry_run and len(reconciler.plan) >= batch_size:
+            reconciler.apply(reconciler.take())
+
+    if errors:
+        raise errors[0]
+
+    if source.window:
+        reconciler.finish(*source.window, source.unresolved)
+    if not dry_run:
+        reconciler.apply(reconciler.take())
 
 # ------------------------------------------------------------------------------
 
@@ -83,14 +422,106 @@ if __name__ == '__main__':
 
     # Parse arguments
     parser = argparse.ArgumentParser(description='cine2cal')
+    parser.add_argument('--batch-size', '-b', type=int, default=50,
+                        help='Number of calendar requests per batch.')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help='Directory for cached movie pages.')
+    parser.add_argument('--calendar-rate', type=float, default=10.0,
+                        help='Calendar API requests per second, 0 for no '
+                             'limit.')
+    parser.add_argument('--concurrency', '-c', type=int, default=3,
+                        help='Number of concurrent page fetches.')
+    parser.add_argument('--cprofile', type=str, default=None,
+                        help='Write cProfile stats of the run to this file.')
     parser.add_argument('--delete', '-d', type=int, default=0,
                         help='How many days in the past to delete old events.')
     parser.add_argument('--dry-run', '-n', action='store_true',
-                        help='Don\'t insert events into the calendar.')
+                        help='Print the planned calendar changes instead '
+                             'of making them.')
+    parser.add_argument('--engine', '-e', choices=['threads', 'async'],
+                        default='threads',
+                        help='Fetch engine, async requires aiohttp.')
+    parser.add_argument('--ics', type=str, default=None,
+                        help='Write the program to an iCalendar feed file '
+                             'instead of syncing Google calendars.')
+    parser.add_argument('--ics-port', type=int, default=None,
+                        help='Serve the feed over HTTP on this port, '
+                             'with --watch.')
+    parser.add_argument('--jitter', type=float, default=0.1,
+                        help='Spread the watch interval by up to this '
+                             'fraction.')
+    parser.add_argument('--migrate-keys', action='store_true',
+                        help='Add screening keys to events created by older '
+                             'versions, a year back and ahead.')
+    parser.add_argument('--mirror', type=str, default=None,
+                        help='Local mirror file of the calendar events.')
     parser.add_argument('--movies', '-m', type=int, default=20,
-                        help='Number of movies to scrape.')
+                        help='Number of movies to scrape, 0 for all.')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Don\'t cache movie pages between runs.')
+    parser.add_argument('--no-mirror', action='store_true',
+                        help='Read the calendar events from the API on every '
+                             'run instead of syncing a local mirror.')
+    parser.add_argument('--no-program', action='store_true',
+                        help='Don\'t keep the scraped program in the program '
+                             'database.')
+    parser.add_argument('--no-state', action='store_true',
+                        help='Sync all movies, not only new and changed.')
+    parser.add_argument('--pages', type=int, default=50,
+                        help='Max number of program pages to crawl.')
     parser.add_argument('--notifications', '-N', action='store_true',
                         help='Enable notifications for calendar events.')
+    parser.add_argument('--parse-workers', type=int, nargs='?', default=0,
+                        const=os.cpu_count(),
+                        help='Worker processes parsing movie pages, one per '
+                             'core if no number is given.')
+    parser.add_argument('--program', type=str, default=PROGRAM_FILE,
+                        help='Program database of scraped screenings.')
+    parser.add_argument('--profile', '-p', action='store_true',
+                        help='Print time, calls and bytes per phase.')
+    parser.add_argument('--profile-json', type=str, default=None,
+                        help='Write the phase metrics as JSON to this file.')
+    parser.add_argument('--profile-prom', type=str, default=None,
+                        help='Write the phase metrics in Prometheus text '
+                             'format to this file.')
+    parser.add_argument('--query', '-q', type=str, default=None,
+                        help='Sync the screenings of this stored query of '
+                             'the program database, see program.py. Only '
+                             'events of screenings the query has selected '
+                             'before, or that left the program, are '
+                             'deleted.')
+    parser.add_argument('--queue-size', type=int, default=64,
+                        help='Max movies buffered between scraping and '
+                             'calendar sync in streaming mode, and between '
+                             'sources scraped concurrently.')
+    parser.add_argument('--rate', '-r', type=float, default=5.0,
+                        help='Max requests per second per host, 0 for no '
+                             'limit.')
+    parser.add_argument('--source', action='append', default=None,
+                        help='Source plugin to scrape, by name or as '
+                             'module.Class. Repeat to scrape several '
+                             'sources concurrently, default cinemateket.')
+    parser.add_argument('--state', '-s', type=str, default=STATE_FILE,
+                        help='State file of synced screenings.')
+    parser.add_argument('--stream', action='store_true',
+                        help='Sync movies to the calendar while scraping.')
+    parser.add_argument('--targets', '-t', type=str, default=None,
+                        help='JSON config of calendars to sync the program '
+                             'to.')
+    parser.add_argument('--until', '-u', type=date.fromisoformat,
+                        default=None,
+                        help='Scrape movies up to this date (YYYY-MM-DD).')
     parser.add_argument('--verbose', '-v', action='store_true', help='Verbose')
+    parser.add_argument('--watch', '-w', type=float, default=0,
+                        metavar='INTERVAL',
+                        help='Keep running and sync every INTERVAL seconds.')
     args = parser.parse_args()
-    main(args)
+
+    if args.cprofile:
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(main, args)
+        finally:
+            profiler.dump_stats(args.cprofile)
+    else:
+        main(args)
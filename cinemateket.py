@@ -1,209 +1,433 @@
 # -----------------------------------------------------------------------------
 
-import concurrent.futures
+from __future__ import annotations
 import datetime
+from collections.abc import Iterator
+import concurrent.futures
 from dataclasses import dataclass
-import re
-from threading import Lock
+import hashlib
+import math
+import multiprocessing
+import os
+import sys
+from threading import Event, Lock
+import weakref
 
-
-from bs4 import BeautifulSoup as bs
-from halo import Halo
-import requests
-from tabulate import tabulate
+import extract
+from fetch import Fetcher
+from metrics import metrics
+from source import Source
 
 
 # -----------------------------------------------------------------------------
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class MovieLength:
     hours: int
     minutes: int
 
 
-@dataclass
-class Movie:
+@dataclass(slots=True, eq=False, weakref_slot=True)
+class Film:
+    """A film and the details from its page, shared by all its screenings"""
     name: str
     link: str
-    start: datetime.datetime
-    end: datetime.datetime
-    theater: str
     year: str
     length: MovieLength
 
+    @classmethod
+    def intern(cls, name: str, link: str, year: str,
+               length: MovieLength) -> Film:
+        """The one Film record with these details"""
+
+        key = (name, link, year, length)
+        with _interning:
+            film = _films.get(key)
+            if film is None:
+                film = _films[key] = cls(name=sys.intern(name),
+                                         link=sys.intern(link), year=year,
+                                         length=length)
+        return film
+
+
+# Films in use, and the table of theater names a screening refers to by id.
+# Screenings are created by the threads of several sources at once.
+_films: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+_theaters: list[str] = []
+_theater_ids: dict[str, int] = {}
+_interning = Lock()
+
+
+def _theater_id(theater: str) -> int:
+    with _interning:
+        if theater not in _theater_ids:
+            _theater_ids[theater] = len(_theaters)
+            _theaters.append(sys.intern(theater))
+        return _theater_ids[theater]
+
+
+@dataclass(slots=True)
+class Screening:
+    """A screening of a film. Name, link, year and length are those of the
+    film and the end time follows from the length."""
+    film: Film
+    start: datetime.datetime
+    theater_id: int
+
+    @classmethod
+    def create(cls, name: str, link: str, start: datetime.datetime,
+               theater: str, year: str, length: MovieLength) -> Screening:
+        return cls(film=Film.intern(name, link, year, length), start=start,
+                   theater_id=_theater_id(theater))
+
+    @property
+    def name(self) -> str:
+        return self.film.name
+
+    @property
+    def link(self) -> str:
+        return self.film.link
+
+    @property
+    def year(self) -> str:
+        return self.film.year
+
+    @property
+    def length(self) -> MovieLength:
+        return self.film.length
+
+    @property
+    def theater(self) -> str:
+        return _theaters[self.theater_id]
+
+    @property
+    def end(self) -> datetime.datetime:
+        return self.start + datetime.timedelta(hours=self.length.hours,
+                                               minutes=self.length.minutes)
+
 
-class Cinemateket():
+# A movie is a screening, the name is kept for the calendar and state code
+Movie = Screening
 
-    def __init__(self, args) -> None:
 
-        self.site = 'http://www.filminstitutet.se'
-        self.index = '/sv/se-och-samtala-om-film/cinemateket-stockholm/' \
-                     'program/?eventtype=&listtype=&page=20'
-        self.movies: list[Movie] = []
-        self.verbose: bool = args.verbose
+def screening_key(link: str, start: datetime.datetime) -> str:
+    """Deterministic key of a screening, from the movie link and the start
+    as local wall clock time"""
 
-        self._import_movies(args.movies)
+    start = start.replace(tzinfo=None, second=0, microsecond=0)
+    return hashlib.sha1(
+        f'{link}|{start.isoformat()}'.encode()).hexdigest()[:20]
+
+
+class Cinemateket(Source):
+    """The program of Cinemateket Stockholm, crawled from its index pages
+    and the page of each film"""
+
+    name = 'cinemateket'
+    site = 'http://www.filminstitutet.se'
+    index = '/sv/se-och-samtala-om-film/cinemateket-stockholm/' \
+            'program/?eventtype=&listtype=&page={page}'
+
+    def __init__(self, args, fetcher: Fetcher | None = None,
+                 state=None, lazy: bool = False,
+                 stop: Event | None = None) -> None:
+
+        self.max_pages: int = getattr(args, 'pages', 50)
+
+        # Worker processes parsing the movie pages, 0 to parse them in the
+        # thread consuming the pages
+        self.parse_workers: int = getattr(args, 'parse_workers', 0) or 0
+
+        super().__init__(args, fetcher=fetcher, state=state, lazy=lazy,
+                         stop=stop)
+
+# -----------------------------------------------------------------------------
+
+    def _get_details(self, html: str) -> tuple[str, MovieLength] | None:
+        """Parse year and length from a movie page, None if the page has no
+        movie information."""
+
+        return self._film(*extract.timed_movie(html), len(html))
 
 # -----------------------------------------------------------------------------
 
-    def _get_html_page(self, url: str) -> bs:
-        """Request the URL page and return it as a soup object."""
-
-        # HTTP GET content
-        html = requests.get(self.site + url)
-        if self.verbose:
-            print(f'Fetched {len(html.text)} bytes from page '
-                  f'{self.site} {url}')
-
-        # soupify and return a soup object
-        # lxml is a more forgiving parser and skips som errors
-        return bs(html.text, 'lxml')
-
-# ------------------------------------------------------------------------------
-
-    def _get_movie_details(self,
-                           name: str,
-                           link: str,
-                           date: datetime.datetime,
-                           theater: str) -> Movie | None:
-        """Get and parse movie details."""
-
-        name = name.replace(u'\u2013', '-')
-        year = '-'
-        length = MovieLength(hours=0, minutes=0)
-        marker = 'isningsmaterial'
-
-        # This div contains the movie information divided in paragraphs
-        div = self._get_html_page(link).find(
-            'div', 'article__editorial-content')
-        if not div or not hasattr(div, 'find_all'):
+    def _film(self, parsed: tuple | None, seconds: float,
+              size: int) -> tuple[str, MovieLength] | None:
+        """Year and length of a parsed movie page"""
+
+        metrics.add('parse details', seconds, calls=1, size=size)
+        if parsed is None:
             return None
 
-        # Extract year, start and end of movie
-        paragraphs = div.find_all('p')  # type: ignore
+        filmfakta, year, hours, minutes = parsed
+        if filmfakta and self.verbose:
+            print(filmfakta)
 
-        for p in paragraphs:
-            if marker in p.get_text():
-                filmfakta = p.get_text()
-                if self.verbose:
-                    print(filmfakta)
-
-                # Extract year
-                y_match = re.search(r'(\d{4})', filmfakta)
-                year = str(y_match.group(1)) if y_match else '-'
-
-                # Extract hours & minutes
-                h_match = re.search(r'(\d+) tim', filmfakta)
-                m_match = re.search(r'(\d+) min', filmfakta)
-                length = MovieLength(
-                    hours=int(h_match.group(1)) if h_match else 0,
-                    minutes=int(m_match.group(1)) if m_match else 0
-                )
-                break
-
-        # Calculate end time
-        end = date + datetime.timedelta(
-            hours=length.hours,
-            minutes=length.minutes
-        )
-
-        return Movie(name=name, link=self.site + link, start=date, end=end,
-                     theater=theater, year=year, length=length)
+        return year, MovieLength(hours=hours, minutes=minutes)
 
 # -----------------------------------------------------------------------------
 
-    def _import_movies(self, max_movies: int) -> int:
-        """Get movies and store in a dictionary. Create a list of dictionaries
-        and store in object.
-        """
+    def _films(self, pages: Iterator[tuple[int, str | None]]
+               ) -> Iterator[tuple[int, tuple[str, MovieLength] | None]]:
+        """Parse the fetched movie pages, in order or, with a parse pool, as
+        the workers are done with them. The pages keep being fetched while
+        the workers parse."""
+
+        if not self.parse_workers:
+            for i, html in pages:
+                yield i, self._get_details(html) if html is not None else None
+            return
+
+        # Workers are not forked from this process, they would inherit the
+        # locks held by the fetch threads
+        method = 'forkserver' if 'forkserver' in \
+            multiprocessing.get_all_start_methods() else 'spawn'
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.parse_workers,
+                mp_context=multiprocessing.get_context(method)) as pool:
+            pending: dict[concurrent.futures.Future, tuple[int, int]] = {}
+
+            def done() -> Iterator[tuple[int, tuple | None]]:
+                for future in [f for f in pending if f.done()]:
+                    i, size = pending.pop(future)
+                    yield i, self._film(*future.result(), size)
+
+            for i, html in pages:
+                if html is None:
+                    yield i, None
+                    continue
+
+                future = pool.submit(extract.timed_movie, html)
+                pending[future] = (i, len(html))
+
+                # Let the pages wait in the fetcher rather than in memory
+                # when the workers fall behind
+                if len(pending) > 2 * self.parse_workers:
+                    concurrent.futures.wait(
+                        pending,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                yield from done()
+
+            concurrent.futures.wait(pending)
+            yield from done()
 
-        # A spinner to indicate progress
-        spinner = Halo(text='Fetching movies.', spinner='moon')
-        spinner.start()
+# -----------------------------------------------------------------------------
 
-        # Thread-safe lock for adding movies
-        movies_lock = Lock()
+    def _parse_article(self, article: tuple) -> tuple | None:
+        """Parse name, link, date and theater from an index article."""
 
-        # Loop articles and extract key values, up to max_movies
-        articles = self._get_html_page(
-            self.index).find_all('article', 'promoted-item')[:max_movies]
+        try:
+            name, link, when, theater = article
+            if not name or not link:
+                return None
 
-        if self.verbose:
-            print(f'Found {len(articles)} movies to process')
+            now = datetime.datetime.now()
+            date = datetime.datetime.strptime(when[4:] + ' ' + str(now.year),
+                                              '%d/%m kl. %H:%M %Y')
 
-        def process_article(article):
-            try:
-                name = article.h3.string
-                if not name:
-                    return None
+            # The season continues into next year
+            if date < now - datetime.timedelta(days=31):
+                date = date.replace(year=now.year + 1)
 
-                link = article.a['href']
-                year = (datetime.datetime.now()).year
-                date = datetime.datetime.strptime(article.span.string[4:] +
-                                                  ' ' + str(year),
-                                                  '%d/%m kl. %H:%M %Y')
-                theater = article.find_all('span')[1].string
+            if self.verbose:
+                print(f'Found movie {name} shown {date} at {theater}')
 
-                if self.verbose:
-                    print(f'Found movie {name} shown {date} at {theater}')
+            return name, link, date, theater
 
-                # Get the details from the specific movie page
-                movie = self._get_movie_details(name, link, date, theater)
+        except (TypeError, ValueError) as e:
+            if self.verbose:
+                print(f'Error processing movie: {e}')
+            return None
 
-                # Add movie to the instance's movie list
-                if movie:
-                    with movies_lock:
-                        self.movies.append(movie)
-                    if self.verbose:
-                        print(f'Added movie {name} to list')
-                    return movie
+# -----------------------------------------------------------------------------
+
+    def _crawl(self, max_movies: int) -> Iterator[tuple]:
+        """Crawl the program index pages and yield every screening once.
+
+        Pages are fetched in parallel, a wave of up to concurrency pages at
+        a time. The crawl stops at the date horizon self.until, after
+        max_movies screenings (0 for no limit), when a page has nothing new
+        to offer or when self.stop is set.
+        """
+
+        seen: set[tuple[str, datetime.datetime]] = set()
+        page = 1
+        page_size = 0
+
+        while page <= self.max_pages:
+            if self.stop and self.stop.is_set():
+                return
+
+            # Fetch only as many pages as are needed for max_movies
+            wave = self.fetcher.concurrency if page_size else 1
+            if max_movies and page_size:
+                wave = min(wave, math.ceil((max_movies - len(seen)) /
+                                           page_size))
+            wave = min(wave, self.max_pages - page + 1)
+
+            # The program changes daily so the index pages are never cached
+            pages = dict(self.fetcher.imap(
+                [self.site + self.index.format(page=page + i)
+                 for i in range(wave)], cache=False, phase='index'))
+
+            for i in range(wave):
+                html = pages.get(i) or ''
+                with metrics.timer('parse index', calls=1, size=len(html)):
+                    articles = extract.articles(html)
+                page_size = max(page_size, len(articles))
 
-            except AttributeError as e:
                 if self.verbose:
-                    print(f'Error processing movie: {e}')
-                return None
+                    print(f'Found {len(articles)} movies on page {page + i}')
 
-        # Use ThreadPoolExecutor to fetch movies in parallel
-        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-            futures = [executor.submit(process_article, article)
-                       for article in articles]
+                new = 0
+                for screening in map(self._parse_article, articles):
+                    if not screening:
+                        continue
+                    _, link, date, _ = screening
+                    if (link, date) in seen:
+                        continue
+                    if self.until and date.date() > self.until:
+                        return
 
-            # Wait for all futures to complete
-            concurrent.futures.wait(futures)
+                    seen.add((link, date))
+                    new += 1
+                    yield screening
 
-        spinner.stop_and_persist(symbol=u'\N{check mark}',
-                                 text=f'Fetched {len(self.movies)} movies.')
-        return len(self.movies)
+                    if max_movies and len(seen) >= max_movies:
+                        return
 
-# -----------------------------------------------------------------------------
+                if not new:
+                    return
 
-    def count(self) -> int:
-        return len(self.movies)
+            page += wave
 
 # -----------------------------------------------------------------------------
 
-    def list(self) -> list[Movie]:
-        return self.movies
+    def iter_movies(self, max_movies: int | None = None) -> Iterator[Movie]:
+        """Get movies and yield each one as soon as its page is parsed.
+        Movies are also added to the instance's movie list. The page of a
+        film is fetched once for all its screenings.
 
-# -----------------------------------------------------------------------------
+        Index pages are crawled while detail pages are being fetched. The
+        time window of the screenings found so far is kept in self.window,
+        it covers every movie by the time it is yielded.
+        """
+
+        known: list[Movie] = []
+
+        # Details of each film page, None while the page is being fetched
+        # and if it failed, and the screenings waiting for a page
+        details: dict[str, tuple[str, MovieLength] | None] = {}
+        waiting: dict[str, list[tuple]] = {}
+        fetched: list[str] = []
+        lock = Lock()
+
+        def screening(name: str, link: str, date: datetime.datetime,
+                      theater: str,
+                      film: tuple[str, MovieLength]) -> Screening:
+            return Screening.create(name=name.replace(u'\u2013', '-'),
+                                    link=self.site + link, start=date,
+                                    theater=theater, year=film[0],
+                                    length=film[1])
+
+        def links() -> Iterator[str]:
+            """Film page links of screenings not already synced, each page
+            only once"""
+
+            for article in self._crawl(max_movies if max_movies is not None
+                                       else self.max_movies):
+                name, link, date, theater = article
+                first, last = self.window or (date, date)
+                self.window = (min(first, date), max(last, date))
+
+                movie = self.state.movie(self.site + link, date, theater) \
+                    if self.state else None
+                if movie:
+                    known.append(movie)
+                    continue
+
+                with lock:
+                    if link in waiting:
+                        waiting[link].append(article)
+                        continue
+                    if link in details:
+                        film = details[link]
+                        if film:
+                            known.append(screening(*article, film))
+                        continue
+                    details[link] = None
+                    waiting[link] = [article]
+                    fetched.append(link)
+
+                yield self.site + link
+
+        def flush() -> Iterator[Movie]:
+            while known:
+                movie = known.pop(0)
+                self.movies.append(movie)
+                yield movie
+
+        # Fetch the film pages in parallel with the fetch engine and get the
+        # screenings of each film as its page is parsed
+        for i, film in self._films(self.fetcher.imap(links(),
+                                                     phase='details')):
+            yield from flush()
+
+            with lock:
+                details[fetched[i]] = film
+                articles = waiting.pop(fetched[i])
+
+            # The screenings of a film whose page failed are still in the
+            # program
+            if not film:
+                self.unresolved.add(self.site + fetched[i])
+                continue
+
+            for article in articles:
+                movie = screening(*article, film)
+                self.movies.append(movie)
+                if self.verbose:
+                    print(f'Added movie {movie.name} to list')
+                yield movie
+
+        yield from flush()
 
-    def pop(self) -> Movie:
-        return self.movies.pop()
+        self.movies.sort(key=lambda movie: movie.start)
 
 # -----------------------------------------------------------------------------
 
-    def print(self) -> None:
-        """Print all movies in a formatted table"""
-        table_data = [
-            [
-                f'{movie.start.strftime('%Y-%m-%d %H:%M')}',
-                movie.name,
-                movie.year,
-                movie.theater,
-                f'{movie.length.hours}h {movie.length.minutes}m'
-            ]
-            for movie in self.movies
-        ]
-
-        headers = ['Time', 'Movie', 'Year', 'Theater', 'Length']
-        print(tabulate(table_data, headers=headers, tablefmt='simple'))
+
+if __name__ == '__main__':
+    """Scrape the program and print it, without the Google calendar stack"""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='cinemateket')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help='Directory for cached movie pages.')
+    parser.add_argument('--concurrency', '-c', type=int, default=3,
+                        help='Number of concurrent page fetches.')
+    parser.add_argument('--engine', '-e', choices=['threads', 'async'],
+                        default='threads',
+                        help='Fetch engine, async requires aiohttp.')
+    parser.add_argument('--movies', '-m', type=int, default=20,
+                        help='Number of movies to scrape, 0 for all.')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Don\'t cache movie pages between runs.')
+    parser.add_argument('--pages', type=int, default=50,
+                        help='Max number of program pages to crawl.')
+    parser.add_argument('--parse-workers', type=int, nargs='?', default=0,
+                        const=os.cpu_count(),
+                        help='Worker processes parsing movie pages, one per '
+                             'core if no number is given.')
+    parser.add_argument('--rate', '-r', type=float, default=5.0,
+                        help='Max requests per second per host, 0 for no '
+                             'limit.')
+    parser.add_argument('--until', '-u', type=datetime.date.fromisoformat,
+                        default=None,
+                        help='Scrape movies up to this date (YYYY-MM-DD).')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Verbose')
+
+    cinemateket = Cinemateket(parser.parse_args())
+    cinemateket.fetcher.close()
+    cinemateket.print()
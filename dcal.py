@@ -2,22 +2,84 @@
 
 from __future__ import print_function
 from __future__ import annotations
+from collections.abc import Callable
 from datetime import datetime, timedelta, timezone
 from dataclasses import dataclass
 import json
 import os
+import random
 import sys
+import tempfile
+from threading import Lock
+import time
 
 from dateutil.parser import parse
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
+from google.auth.exceptions import RefreshError
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+from googleapiclient.discovery import DISCOVERY_URI, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+import httplib2
 
-from cinemateket import Movie
+from cache import CACHE_DIR
+from cinemateket import Movie, screening_key
+from metrics import metrics
+from ratelimit import RateLimiter
 
 # ------------------------------------------------------------------------------
 
+# Event fields that follow the screening and are kept up to date
+PATCH_FIELDS = ['summary', 'location', 'description', 'start', 'end',
+                'extendedProperties']
+
+# Event fields read from the calendar, requested with partial responses
+EVENT_FIELDS = 'id,status,htmlLink,summary,location,description,start,end,' \
+               'extendedProperties'
+
+# Largest page of events the API returns
+MAX_RESULTS = 2500
+
+# Calendar requests per second and burst, within the default Calendar API
+# quota of 600 requests per minute and user
+CALENDAR_RATE = 10.0
+CALENDAR_BURST = 50
+
+# Longest wait before a retry, in seconds
+MAX_BACKOFF = 32.0
+
+# Local copy of the Calendar API discovery document, fetched again when it
+# is older than DISCOVERY_TTL seconds. Other versions of the file format are
+# fetched again at once.
+DISCOVERY_FILE = os.path.join(CACHE_DIR, 'calendar-v3.json')
+DISCOVERY_VERSION = 1
+DISCOVERY_TTL = 7 * 24 * 3600
+
+# Access tokens are refreshed when they expire within REFRESH_MARGIN
+REFRESH_MARGIN = timedelta(minutes=10)
+
+# The discovery document and the credentials are loaded once per process
+# and shared by all calendars
+_documents: dict[str, dict] = {}
+_credentials: dict[str, Credentials] = {}
+_lock = Lock()
+
+
+class _Request(HttpRequest):
+    """API request that keeps the size of its response body. The API client
+    asks for gzip responses, the size is after decompression."""
+
+    def __init__(self, http, postproc, uri, *args, **kwargs) -> None:
+        super().__init__(http, self._postproc, uri, *args, **kwargs)
+        self._parse = postproc
+        self.size: int = 0
+
+    def _postproc(self, resp, content):
+        self.size = len(content)
+        return self._parse(resp, content)
+
 
 @dataclass
 class CalendarEvent:
@@ -38,7 +100,10 @@ class CineCal():
                  args,
                  timezone: str = 'Europe/Stockholm',
                  attendees=None,
-                 tag: str = 'CINEMATEKET') -> None:
+                 tag: str = 'CINEMATEKET',
+                 http=None,
+                 calendar_id: str = 'primary',
+                 rate: float | None = None) -> None:
 
         self.verbose: bool = args.verbose
         self.credentials_file: str = 'client_secret.json'
@@ -46,48 +111,55 @@ class CineCal():
         self.name: str = 'dcal'
         self.scopes: str = 'https://www.googleapis.com/auth/calendar'
         self.tag: str = tag
+        self.calendar_id: str = calendar_id
         self.timezone: str = timezone
         self.service: object = None
-        self._connect_calendar()
+        self.credentials: Credentials | None = None
+
+        # Local mirror of the tagged events to read instead of the API
+        self.mirror = None
+        self.batch_size: int = getattr(args, 'batch_size', 50)
+        self.retries: int = 5
+
+        # Calendar requests per second, calendars synced concurrently have
+        # one limiter each. The rate is lowered while the API throttles.
+        if rate is None:
+            rate = getattr(args, 'calendar_rate', CALENDAR_RATE)
+        self.limiter = RateLimiter(rate, CALENDAR_BURST)
+        self.stats: dict[str, int] = {'inserted': 0, 'updated': 0,
+                                      'deleted': 0, 'failed': 0}
+        self._connect_calendar(http)
 
 # ------------------------------------------------------------------------------
 
     def _get_credentials(self) -> Credentials:
-        """Gets valid user credentials from storage.
+        """Gets valid user credentials from memory or storage.
 
         If nothing has been stored, or if the stored credentials are invalid,
-        the OAuth2 flow is completed to obtain the new credentials.
+        the OAuth2 flow is completed to obtain the new credentials. Tokens
+        about to expire are refreshed before they are used.
 
         Returns:
             Credentials object
         """
-        creds = None
         token_dir = os.path.join(os.path.expanduser('~'), '.credentials')
-        if not os.path.exists(token_dir):
-            os.makedirs(token_dir)
+        os.makedirs(token_dir, exist_ok=True)
         token_file = os.path.join(token_dir, 'calendar-token.json')
 
-        if os.path.exists(token_file):
-            try:
-                # workaround for
-                # https://github.com/googleapis/google-auth-library-python/issues/501
-                with open(token_file, 'r') as stream:
-                    creds_json = json.load(stream)
-                creds = Credentials.from_authorized_user_info(creds_json)
-                creds.token = creds_json['token']
-                if self.verbose:
-                    print(f'Loaded credentials from {token_file}')
-
-            except Exception as e:
-                sys.stderr.write(f'Failed to load existing credentials: {e}\n')
-                os.remove(token_file)
-                return self._get_credentials()
+        with _lock:
+            creds = _credentials.get(token_file) or \
+                self._load_credentials(token_file)
 
-        # If there are no (valid) credentials available, let the user log in.
-        if not creds or not creds.token:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
+            try:
+                if creds:
+                    self._refresh(creds, token_file)
+            except RefreshError as e:
+                sys.stderr.write(f'Failed to refresh credentials: {e}\n')
+                creds = None
+
+            # If there are no (valid) credentials available, let the user
+            # log in.
+            if not creds:
                 if not os.path.exists(self.credentials_file):
                     raise FileNotFoundError(
                         f'Missing {self.credentials_file}. Download it from '
@@ -97,28 +169,165 @@ class CineCal():
                 flow = InstalledAppFlow.from_client_secrets_file(
                     self.credentials_file, [self.scopes])
                 creds = flow.run_local_server(port=0)
+                self._save_credentials(creds, token_file)
 
-                # Save the credentials for the next run
-                creds_data = {
-                    'token': creds.token,
-                    'refresh_token': creds.refresh_token,
-                    'token_uri': creds.token_uri,
-                    'client_id': creds.client_id,
-                    'client_secret': creds.client_secret,
-                    'scopes': creds.scopes
-                }
+            _credentials[token_file] = creds
+            return creds
 
-                with open(token_file, 'w') as token:
-                    json.dump(creds_data, token)
-                    if self.verbose:
-                        print(f'Saved creds to {token_file}')
+# ------------------------------------------------------------------------------
+
+    def _load_credentials(self, token_file: str) -> Credentials | None:
+        """Load stored credentials, None if there are none or if they are
+        invalid"""
 
-        return creds
+        if not os.path.exists(token_file):
+            return None
+
+        try:
+            # workaround for
+            # https://github.com/googleapis/google-auth-library-python/issues/501
+            with open(token_file, 'r') as stream:
+                creds_json = json.load(stream)
+            creds = Credentials.from_authorized_user_info(creds_json)
+            creds.token = creds_json['token']
+            if self.verbose:
+                print(f'Loaded credentials from {token_file}')
+            return creds
+
+        except Exception as e:
+            sys.stderr.write(f'Failed to load existing credentials: {e}\n')
+            os.remove(token_file)
+            return None
 
 # ------------------------------------------------------------------------------
 
-    def _connect_calendar(self) -> None:
-        """Connect to Google calendar"""
+    def _save_credentials(self, creds: Credentials, token_file: str) -> None:
+        """Atomically save the credentials, with the token expiry, for the
+        next run"""
+
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(token_file),
+                                   suffix='.tmp')
+        with os.fdopen(fd, 'w') as token:
+            token.write(creds.to_json())
+        os.replace(tmp, token_file)
+        if self.verbose:
+            print(f'Saved creds to {token_file}')
+
+# ------------------------------------------------------------------------------
+
+    def _refresh(self, creds: Credentials, token_file: str) -> None:
+        """Refresh the access token if it expires within REFRESH_MARGIN, or
+        if its expiry is unknown as for tokens saved by older versions"""
+
+        if not creds.refresh_token:
+            return
+
+        # Expiry is naive UTC
+        expiry = creds.expiry
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        if creds.token and expiry and expiry - now > REFRESH_MARGIN:
+            return
+
+        with metrics.timer('oauth refresh', calls=1):
+            creds.refresh(Request())
+        self._save_credentials(creds, token_file)
+
+# ------------------------------------------------------------------------------
+
+    def refresh_credentials(self) -> None:
+        """Refresh the access token ahead of its expiry, so that no API call
+        waits for it. Called before each sync in watch mode. The service is
+        rebuilt on new credentials, as after logging in again."""
+
+        if not self.credentials:
+            return
+
+        creds = self._get_credentials()
+        if creds is not self.credentials:
+            self.credentials = creds
+            with metrics.timer('connect'):
+                self.service = build_from_document(
+                    self._discovery_document(),
+                    credentials=self.credentials,
+                    requestBuilder=_Request)
+
+# ------------------------------------------------------------------------------
+
+    def _discovery_document(self) -> dict:
+        """The Calendar API discovery document, from memory or the local
+        copy. A missing or outdated copy is replaced, a stale copy is used
+        if no document can be had."""
+
+        with _lock:
+            if DISCOVERY_FILE in _documents:
+                return _documents[DISCOVERY_FILE]
+
+            document, fresh = None, False
+            try:
+                with open(DISCOVERY_FILE, 'r', encoding='utf-8') as stream:
+                    data = json.load(stream)
+                if data.get('version') == DISCOVERY_VERSION:
+                    document = data['document']
+                    fresh = time.time() - data['fetched'] < DISCOVERY_TTL
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, KeyError) as e:
+                sys.stderr.write(f'Failed to load discovery document: {e}\n')
+
+            if not fresh:
+                try:
+                    document = self._fetch_discovery_document()
+                except Exception as e:
+                    if not document:
+                        raise
+                    sys.stderr.write(f'Failed to fetch discovery document, '
+                                     f'using the local copy: {e}\n')
+
+            _documents[DISCOVERY_FILE] = document  # type: ignore
+            return document  # type: ignore
+
+# ------------------------------------------------------------------------------
+
+    def _fetch_discovery_document(self) -> dict:
+        """Get the discovery document bundled with the API client, or else
+        download it, and save a local copy"""
+
+        with metrics.timer('discovery', calls=1):
+            content = get_static_doc('calendar', 'v3')
+            if not content:
+                response, content = httplib2.Http(timeout=10).request(
+                    DISCOVERY_URI.format(api='calendar', apiVersion='v3'))
+                if response.status != 200:
+                    raise Exception(f'Failed to download discovery '
+                                    f'document: HTTP {response.status}')
+            document = json.loads(content)
+
+        directory = os.path.dirname(DISCOVERY_FILE)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as stream:
+                json.dump({'version': DISCOVERY_VERSION,
+                           'fetched': time.time(),
+                           'document': document}, stream)
+            os.replace(tmp, DISCOVERY_FILE)
+        except OSError as e:
+            sys.stderr.write(f'Failed to save discovery document: {e}\n')
+
+        return document
+
+# ------------------------------------------------------------------------------
+
+    def _connect_calendar(self, http=None) -> None:
+        """Connect to Google calendar. If an http transport is given it is
+        used as is and no credentials are loaded."""
+
+        if http:
+            with metrics.timer('connect'):
+                self.service = build_from_document(
+                    self._discovery_document(), http=http,
+                    requestBuilder=_Request)
+            return
 
         if not os.path.exists(self.credentials_file):
             raise Exception(
@@ -127,11 +336,13 @@ class CineCal():
                 'directory.')
 
         try:
-            credentials = self._get_credentials()
-            self.service = build(
-                'calendar', 'v3',
-                credentials=credentials,
-                cache_discovery=False)
+            with metrics.timer('oauth'):
+                self.credentials = self._get_credentials()
+            with metrics.timer('connect'):
+                self.service = build_from_document(
+                    self._discovery_document(),
+                    credentials=self.credentials,
+                    requestBuilder=_Request)
         except Exception as e:
             sys.stderr.write(f'Failed to connect to calendar: {e}\n')
 
@@ -147,26 +358,33 @@ class CineCal():
             time_min = time_event.replace(hour=0, minute=0, second=0)
             time_max = time_event.replace(hour=23, minute=59, second=59)
 
-            events = self.service.events().list(  # type: ignore
-                calendarId='primary',
-                timeMin=time_min.isoformat() + 'Z',
-                timeMax=time_max.isoformat() + 'Z',
-                singleEvents=True,
-                orderBy='startTime').execute()
+            if self.mirror:
+                events = {'items': self.mirror.scan(time_min, time_max)}
+            else:
+                events = self._read(
+                    self.service.events().list(  # type: ignore
+                        calendarId=self.calendar_id,
+                        timeMin=time_min.isoformat() + 'Z',
+                        timeMax=time_max.isoformat() + 'Z',
+                        singleEvents=True,
+                        orderBy='startTime',
+                        fields=f'items({EVENT_FIELDS})'))
         except Exception as e:
             sys.stderr.write(f'Failed to fetch events: {e}\n')
             return None
 
-        # Loop over retrieved events
+        # Loop over all retrieved events, other events (e.g. all-day events
+        # without a dateTime) may share the same time slot
         for event in events.get('items', []):
 
-            # Convert calendar time to datetime object with dateutil
-            event['start']['dateTime'] = parse(event['start']['dateTime'])
+            # Break (and return) if this event has correct tag and the same
+            # name
+            if (self._is_tagged(event) and
+                    movie_name in event.get('summary', '')):
 
-            # Set myevent, Break (and return) if this event has
-            # correct tag and the same name
-            if (event['description'].split(':')[0] == self.tag and
-                    movie_name in event['summary']):
+                # Convert calendar time to datetime object with dateutil
+                event['start']['dateTime'] = parse(
+                    event['start']['dateTime'])
                 if self.verbose:
                     print(f'Found event in calendar: '
                           f'{event['start']['dateTime']} '
@@ -175,6 +393,161 @@ class CineCal():
 
         return None
 
+# ------------------------------------------------------------------------------
+
+    def find(self, movie: Movie) -> dict | None:
+        """Get the event of a screening by its screening key"""
+
+        result = self._read(self.service.events().list(  # type: ignore
+            calendarId=self.calendar_id,
+            privateExtendedProperty=(
+                f'screening={self.screening_key(movie.link, movie.start)}'),
+            singleEvents=True,
+            fields=f'items({EVENT_FIELDS})'))
+
+        return next(iter(result.get('items', [])), None)
+
+# ------------------------------------------------------------------------------
+
+    def scan(self, time_min: datetime, time_max: datetime) -> list[dict]:
+        """Fetch all tagged events of the whole days time_min to time_max in
+        a single paginated sweep, or read them from the mirror."""
+
+        if self.mirror:
+            return self.mirror.scan(time_min, time_max)
+
+        time_min = time_min.replace(hour=0, minute=0, second=0)
+        time_max = time_max.replace(hour=23, minute=59, second=59)
+
+        page_token = None
+        events: list[dict] = []
+
+        while True:
+            result = self._read(self.service.events().list(  # type: ignore
+                calendarId=self.calendar_id,
+                timeMin=time_min.isoformat() + 'Z',
+                timeMax=time_max.isoformat() + 'Z',
+                timeZone=self.timezone,
+                q=self.tag,
+                singleEvents=True,
+                maxResults=MAX_RESULTS,
+                fields=f'nextPageToken,items({EVENT_FIELDS})',
+                pageToken=page_token
+            ))
+
+            # Scan every event in the window, not just the first in a slot
+            events += [event for event in result.get('items', [])
+                       if self._is_tagged(event) and
+                       event.get('start', {}).get('dateTime')]
+
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                break
+
+        if self.verbose:
+            print(f'Found {len(events)} tagged events between '
+                  f'{time_min} and {time_max}')
+
+        return events
+
+# ------------------------------------------------------------------------------
+
+    def index(self, time_min: datetime,
+              time_max: datetime) -> dict[tuple[datetime, str], dict]:
+        """Fetch all tagged events between time_min and time_max and index
+        them by (start, normalized title).
+
+        Returns:
+            dictionary mapping (start, title) keys to events.
+        """
+
+        return {self.event_key(parse(event['start']['dateTime']),
+                               event.get('summary', '')): event
+                for event in self.scan(time_min, time_max)}
+
+# ------------------------------------------------------------------------------
+
+    @staticmethod
+    def event_key(start: datetime, title: str) -> tuple[datetime, str]:
+        """Build an index key from a start time and a title. The start time
+        is compared as local wall clock time and the title is compared
+        case-insensitively with collapsed whitespace."""
+
+        start = start.replace(tzinfo=None, second=0, microsecond=0)
+        title = ' '.join(title.replace(u'\u2013', '-').split()).casefold()
+        return start, title
+
+# ------------------------------------------------------------------------------
+
+    @staticmethod
+    def screening_key(link: str, start: datetime) -> str:
+        """Deterministic key of a screening, from the movie link and the
+        start as local wall clock time"""
+
+        return screening_key(link, start)
+
+# ------------------------------------------------------------------------------
+
+    @staticmethod
+    def private(event: dict) -> dict[str, str]:
+        """The private extended properties of an event"""
+
+        return event.get('extendedProperties', {}).get('private', {})
+
+# ------------------------------------------------------------------------------
+
+    @staticmethod
+    def event_link(event: dict) -> str:
+        """Movie link of a tagged event, the last line of its
+        description"""
+
+        return event.get('description', '').rsplit('\n', 1)[-1]
+
+# ------------------------------------------------------------------------------
+
+    def migrate_keys(self, time_min: datetime, time_max: datetime) -> int:
+        """Stamp tagged events between time_min and time_max that predate
+        screening keys with their key, in batches.
+
+        Returns:
+            number of updated events.
+        """
+
+        requests = {}
+        for event in self.scan(time_min, time_max):
+            private = self.private(event)
+            if private.get('screening'):
+                continue
+            key = self.screening_key(self.event_link(event),
+                                     parse(event['start']['dateTime']))
+            event_id = event['id']
+            requests[event_id] = self.service.events().patch(  # type: ignore
+                calendarId=self.calendar_id,
+                eventId=event_id,
+                sendNotifications=False,
+                body={'extendedProperties': {'private': {
+                    **private, 'tag': self.tag, 'screening': key}}})
+
+        num_events = 0
+        for event_id, (_, error) in self._execute_batch(requests).items():
+            if error:
+                sys.stderr.write(f'Failed to update event {event_id}: '
+                                 f'{error}\n')
+                self.stats['failed'] += 1
+            else:
+                num_events += 1
+
+        self.stats['updated'] += num_events
+        return num_events
+
+# ------------------------------------------------------------------------------
+
+    def _is_tagged(self, event: dict) -> bool:
+        """Check if an event was created by us"""
+
+        return self.private(event).get('tag') == self.tag or \
+            event.get('description', '').split(':')[0] == self.tag
+
 # ------------------------------------------------------------------------------
 
     def list(self, days: int) -> list[str]:
@@ -191,19 +564,27 @@ class CineCal():
         else:
             return []
 
+        if self.mirror:
+            return [event['id'] for event in self.mirror.events.values()
+                    if parse(event['end']['dateTime']) > time_min and
+                    parse(event['start']['dateTime']) < time_max]
+
         page_token = None
         event_ids: list[str] = []
 
         while True:
-            events = self.service.events().list(  # type: ignore
-                calendarId='primary',
-                timeMin=time_min.isoformat() + 'Z',
-                timeMax=time_max.isoformat() + 'Z',
+            events = self._read(self.service.events().list(  # type: ignore
+                calendarId=self.calendar_id,
+                timeMin=time_min.isoformat(),
+                timeMax=time_max.isoformat(),
+                maxResults=MAX_RESULTS,
+                fields='nextPageToken,items(id,description,'
+                       'extendedProperties)',
                 pageToken=page_token
-            ).execute()
+            ))
 
-            for event in events['items']:
-                if event['description'].split(':')[0] == self.tag:
+            for event in events.get('items', []):
+                if self._is_tagged(event):
                     event_ids.append(event['id'])
 
             page_token = events.get('nextPageToken')
@@ -217,8 +598,12 @@ class CineCal():
     def delete(self, event_id: str) -> None:
         """Delete a single event"""
 
-        self.service.events().delete(calendarId='primary',  # type: ignore
-                                     eventId=event_id).execute()
+        try:
+            self._execute(self.service.events().delete(  # type: ignore
+                calendarId=self.calendar_id, eventId=event_id))
+        except HttpError as e:
+            if not self._is_gone(e):
+                raise
 
 # ------------------------------------------------------------------------------
 
@@ -233,11 +618,33 @@ class CineCal():
             number of deleted events.
         """
 
+        return self.delete_many(self.list(days))
+
+# ------------------------------------------------------------------------------
+
+    def delete_many(self, event_ids: list[str]) -> int:
+        """Delete events in batches.
+
+        Returns:
+            number of deleted events.
+        """
+
+        requests = {
+            event_id: self.service.events().delete(  # type: ignore
+                calendarId=self.calendar_id, eventId=event_id)
+            for event_id in event_ids
+        }
+
         num_events = 0
-        for event_id in self.list(days):
-            self.delete(event_id)
-            num_events += 1
+        for event_id, (_, error) in self._execute_batch(requests).items():
+            if error and not self._is_gone(error):
+                sys.stderr.write(f'Failed to delete event {event_id}: '
+                                 f'{error}\n')
+                self.stats['failed'] += 1
+            else:
+                num_events += 1
 
+        self.stats['deleted'] += num_events
         return num_events
 
 # ------------------------------------------------------------------------------
@@ -254,13 +661,265 @@ class CineCal():
 
         event = self._build_event(movie)
         try:
-            created_event = self.service.events().insert(  # type: ignore
-                calendarId='primary',
+            request = self.service.events().insert(  # type: ignore
+                calendarId=self.calendar_id,
                 sendNotifications=False,
-                body=event).execute()
+                body=event)
+            created_event = self._execute(
+                request, recover=lambda: self.find(movie))
             print(f'Event created: {created_event.get('htmlLink')}')
+            self.stats['inserted'] += 1
         except Exception as e:
             sys.stderr.write(f'Failed to create event: {e}')
+            self.stats['failed'] += 1
+
+# ------------------------------------------------------------------------------
+
+    def insert_many(self, movies: list[Movie]) -> list[dict | None]:
+        """Create events in batches.
+
+        Returns:
+            list of created events in the same order as movies, None for
+            events that could not be created.
+        """
+
+        requests = {
+            str(i): self.service.events().insert(  # type: ignore
+                calendarId=self.calendar_id,
+                sendNotifications=False,
+                body=self._build_event(movie))
+            for i, movie in enumerate(movies)
+        }
+
+        created: list[dict | None] = [None] * len(movies)
+        for i, (created_event, error) in self._execute_batch(
+                requests, lambda i: self.find(movies[int(i)])).items():
+            if error:
+                sys.stderr.write(f'Failed to create event '
+                                 f'{movies[int(i)].name}: {error}\n')
+                self.stats['failed'] += 1
+            else:
+                print(f'Event created: {created_event.get('htmlLink')}')
+                self.stats['inserted'] += 1
+                created[int(i)] = created_event
+
+        return created
+
+# ------------------------------------------------------------------------------
+
+    def patch_many(self, updates: list[tuple[str, Movie]],
+                   fields: list[list[str]] | None = None) -> list[dict | None]:
+        """Move existing events to the time and place of a screening, in
+        batches.
+
+        Args:
+            updates: list of (event id, movie) tuples
+            fields: the event fields to patch for each update, by default
+                PATCH_FIELDS
+
+        Returns:
+            list of updated events in the same order as updates, None for
+            events that could not be updated.
+        """
+
+        requests = {}
+        for i, (event_id, movie) in enumerate(updates):
+            event = self._build_event(movie)
+            requests[event_id] = self.service.events().patch(  # type: ignore
+                calendarId=self.calendar_id,
+                eventId=event_id,
+                sendNotifications=False,
+                body={key: event[key] for key in
+                      (fields[i] if fields else PATCH_FIELDS)})
+
+        results = self._execute_batch(requests)
+        updated: list[dict | None] = []
+        for event_id, _ in updates:
+            event, error = results[event_id]
+            if error:
+                sys.stderr.write(f'Failed to update event {event_id}: '
+                                 f'{error}\n')
+                self.stats['failed'] += 1
+            else:
+                self.stats['updated'] += 1
+            updated.append(None if error else event)
+
+        return updated
+
+# ------------------------------------------------------------------------------
+
+    def _read(self, request) -> dict:
+        """Execute a request for a page of events, counted as a call with
+        the size of the page in the calendar read phase"""
+
+        return self._execute(request, phase='calendar read')
+
+# ------------------------------------------------------------------------------
+
+    def _execute(self, request,
+                 recover: Callable[[], dict | None] | None = None,
+                 phase: str = 'calendar') -> dict:
+        """Execute a single API request. Requests that fail with a rate
+        limit or server error are retried with exponential backoff.
+
+        Args:
+            request: the HttpRequest
+            recover: for requests that are not idempotent, looks up the
+                result of a request that failed with a server error but may
+                have gone through, before it is retried
+            phase: the metrics phase of the request
+        """
+
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                with metrics.timer(phase, calls=1):
+                    result = request.execute()
+                metrics.add(phase, size=getattr(request, 'size', 0))
+                self.limiter.speed_up()
+                return result
+            except HttpError as e:
+                if attempt == self.retries or not self._is_retryable(e):
+                    raise
+                self._throttled([e])
+                if recover and e.resp.status >= 500 and \
+                        (result := recover()) is not None:
+                    return result
+
+                delay = self._backoff(attempt, e)
+                if self.verbose:
+                    print(f'Retrying request in {delay:.1f}s: {e}')
+                time.sleep(delay)
+                attempt += 1
+
+# ------------------------------------------------------------------------------
+
+    def _execute_batch(self, requests: dict,
+                       recover: Callable[[str], dict | None] | None = None
+                       ) -> dict[str, tuple]:
+        """Execute requests as multi-part batches of batch_size requests.
+        Requests that fail with a rate limit or server error are retried with
+        exponential backoff.
+
+        Args:
+            requests: dictionary of request id to HttpRequest
+            recover: for requests that are not idempotent, looks up the
+                result of a request by id that failed with a server error
+                but may have gone through, before it is retried
+
+        Returns:
+            dictionary of request id to a (response, exception) tuple.
+        """
+
+        results: dict[str, tuple] = {}
+        pending = list(requests)
+
+        for attempt in range(self.retries + 1):
+            retry: dict[str, HttpError] = {}
+
+            def callback(request_id, response, exception):
+                if exception and attempt < self.retries and \
+                        self._is_retryable(exception):
+                    retry[request_id] = exception
+                else:
+                    results[request_id] = (response, exception)
+                    if not exception:
+                        self.limiter.speed_up()
+
+            for i in range(0, len(pending), self.batch_size):
+                chunk = pending[i:i + self.batch_size]
+                batch = self.service.new_batch_http_request(  # type: ignore
+                    callback=callback)
+                for request_id in chunk:
+                    self.limiter.acquire()
+                    batch.add(requests[request_id], request_id=request_id)
+                try:
+                    with metrics.timer('calendar batch', calls=len(chunk)):
+                        batch.execute()
+                except HttpError as e:
+                    for request_id in chunk:
+                        callback(request_id, None, e)
+
+            if not retry:
+                break
+
+            self._throttled(list(retry.values()))
+            if recover:
+                for request_id, error in list(retry.items()):
+                    if error.resp.status < 500:
+                        continue
+                    try:
+                        response = recover(request_id)
+                    except HttpError:
+                        continue
+                    if response is not None:
+                        results[request_id] = (response, None)
+                        del retry[request_id]
+                if not retry:
+                    break
+
+            delay = max(self._backoff(attempt, error)
+                        for error in retry.values())
+            if self.verbose:
+                print(f'Retrying {len(retry)} requests in {delay:.1f}s')
+            time.sleep(delay)
+            pending = list(retry)
+
+        return results
+
+# ------------------------------------------------------------------------------
+
+    def _throttled(self, errors: list[HttpError]) -> None:
+        """Count requests to be retried and slow down if any of them were
+        throttled"""
+
+        throttled = sum(1 for error in errors if error.resp.status < 500)
+        metrics.add('calendar retried', calls=len(errors))
+        if throttled:
+            metrics.add('calendar throttled', calls=throttled)
+            self.limiter.slow_down()
+
+# ------------------------------------------------------------------------------
+
+    @staticmethod
+    def _backoff(attempt: int, error: HttpError) -> float:
+        """Seconds to wait before retry attempt + 1, as asked for by the
+        server or exponential with jitter"""
+
+        try:
+            return float(error.resp['retry-after'])
+        except (KeyError, ValueError):
+            return random.uniform(0.5, 1.0) * min(MAX_BACKOFF, 2 ** attempt)
+
+# ------------------------------------------------------------------------------
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        """Check if an API error is a rate limit or a server error"""
+
+        if not isinstance(error, HttpError):
+            return False
+
+        status = error.resp.status
+        if status == 429 or status >= 500:
+            return True
+        if status == 403:
+            reasons = [d.get('reason') for d in error.error_details or []
+                       if isinstance(d, dict)]
+            return bool({'rateLimitExceeded',
+                         'userRateLimitExceeded'} & set(reasons))
+
+        return False
+
+# ------------------------------------------------------------------------------
+
+    @staticmethod
+    def _is_gone(error: Exception) -> bool:
+        """Check if an API error is for an event that has already been
+        deleted, as by an earlier attempt of a retried delete"""
+
+        return isinstance(error, HttpError) and error.resp.status in (404, 410)
 
 # ------------------------------------------------------------------------------
 
@@ -279,6 +938,12 @@ class CineCal():
                 'dateTime': movie.end.isoformat(),
                 'timeZone': self.timezone
             },
+            'extendedProperties': {
+                'private': {
+                    'tag': self.tag,
+                    'screening': self.screening_key(movie.link, movie.start),
+                },
+            },
             'attendees': [{'email': email} for email in self.attendees],
             'reminders': {
                 'useDefault': False,
@@ -0,0 +1,133 @@
+# -----------------------------------------------------------------------------
+
+import re
+import time
+
+from lxml import etree
+
+# -----------------------------------------------------------------------------
+
+# Precompiled selectors for the program index and the movie pages
+ARTICLES = etree.XPath(
+    '//article[contains(concat(" ", normalize-space(@class), " "), '
+    '" promoted-item ")]')
+EDITORIAL = etree.XPath(
+    '(//div[contains(concat(" ", normalize-space(@class), " "), '
+    '" article__editorial-content ")])[1]')
+PARAGRAPHS = etree.XPath('.//p')
+
+# Year, hours and minutes from the filmfakta paragraph in one pass, each
+# group matches the first occurrence anywhere in the text
+FILMFAKTA = re.compile(r'(?=.*?(?P<year>\d{4}))?'
+                       r'(?=.*?(?P<hours>\d+) tim)?'
+                       r'(?=.*?(?P<minutes>\d+) min)?', re.DOTALL)
+
+# The filmfakta paragraph ends with a note on the screening material
+MARKER = 'isningsmaterial'
+
+
+def _parse(html: str):
+    """Parse a HTML page, lxml is forgiving and skips some errors"""
+
+    return etree.HTML(html) if html else None
+
+# -----------------------------------------------------------------------------
+
+
+def _string(element) -> str | None:
+    """The single string inside an element, like BeautifulSoup's .string.
+    None if the element has no or several children."""
+
+    nodes: list = [element.text] if element.text else []
+    for child in element:
+        nodes.append(child)
+        if child.tail:
+            nodes.append(child.tail)
+
+    if len(nodes) != 1:
+        return None
+
+    return nodes[0] if isinstance(nodes[0], str) else _string(nodes[0])
+
+# -----------------------------------------------------------------------------
+
+
+def articles(html: str) -> list[tuple[str | None, ...]]:
+    """Extract the name, link, time and theater of each screening on a
+    program index page. Missing values are None, articles without time and
+    theater are skipped."""
+
+    root = _parse(html)
+    if root is None:
+        return []
+
+    screenings = []
+    for article in ARTICLES(root):
+        h3 = article.find('.//h3')
+        a = article.find('.//a')
+        spans = article.findall('.//span')
+        if len(spans) < 2:
+            continue
+        screenings.append((
+            _string(h3) if h3 is not None else None,
+            a.get('href') if a is not None else None,
+            _string(spans[0]),
+            _string(spans[1])))
+
+    return screenings
+
+# -----------------------------------------------------------------------------
+
+
+def filmfakta(html: str) -> str | None:
+    """Extract the filmfakta paragraph of a movie page. Returns None if the
+    page has no editorial content and an empty string if it has no
+    filmfakta."""
+
+    root = _parse(html)
+    div = EDITORIAL(root) if root is not None else []
+    if not div:
+        return None
+
+    for p in PARAGRAPHS(div[0]):
+        text = ''.join(p.itertext())
+        if MARKER in text:
+            return text
+
+    return ''
+
+# -----------------------------------------------------------------------------
+
+
+def details(text: str) -> tuple[str, int, int]:
+    """Parse year, hours and minutes from a filmfakta paragraph"""
+
+    match = FILMFAKTA.match(text)
+    return (match['year'] or '-',
+            int(match['hours'] or 0),
+            int(match['minutes'] or 0))
+
+# -----------------------------------------------------------------------------
+
+
+def movie(html: str) -> tuple[str, str, int, int] | None:
+    """Extract the filmfakta paragraph of a movie page with the year, hours
+    and minutes in it. Returns None if the page has no editorial content."""
+
+    text = filmfakta(html)
+    if text is None:
+        return None
+    if not text:
+        return text, '-', 0, 0
+
+    return (text, *details(text))
+
+# -----------------------------------------------------------------------------
+
+
+def timed_movie(html: str) -> tuple[tuple[str, str, int, int] | None, float]:
+    """Extract a movie page with movie() and time it, for worker processes
+    that cannot add to the metrics of the main process"""
+
+    start = time.perf_counter()
+    return movie(html), time.perf_counter() - start
@@ -0,0 +1,272 @@
+# -----------------------------------------------------------------------------
+
+from __future__ import annotations
+from datetime import datetime
+from email.parser import Parser
+import itertools
+import json
+import urllib.parse
+import uuid
+
+import httplib2
+
+# -----------------------------------------------------------------------------
+
+
+class FakeCalendarHttp():
+    """In-memory stand-in for the Google Calendar v3 API.
+
+    Implements the httplib2 request() interface so it can be passed to
+    CineCal (or googleapiclient's build()) as the http transport. Supports
+    events list/get/insert/patch/delete and multipart batch requests, counts
+    round-trips and can inject errors to exercise retries. Unfiltered lists
+    end with a sync token for incremental syncs. Lists honour fields masks
+    and count the bytes of their responses.
+    """
+
+    def __init__(self, page_size: int = 250) -> None:
+        self.events: dict[str, dict] = {}
+        self.page_size: int = page_size
+        self.requests: int = 0
+        self.calls: int = 0
+        self.read_bytes: int = 0
+        self.failures: list[tuple[int, str]] = []
+        self._ids = itertools.count(1)
+
+        # Sequence number of the last change to each event, deleted events
+        # are kept as cancelled
+        self.seq: int = 0
+        self.changed: dict[str, int] = {}
+        self.cancelled: dict[str, dict] = {}
+
+# -----------------------------------------------------------------------------
+
+    def _touch(self, event_id: str) -> None:
+        self.seq += 1
+        self.changed[event_id] = self.seq
+
+# -----------------------------------------------------------------------------
+
+    def fail(self, status: int = 429, count: int = 1,
+             reason: str = 'rateLimitExceeded') -> None:
+        """Make the next count API calls fail with status and reason"""
+
+        self.failures.extend([(status, reason)] * count)
+
+# -----------------------------------------------------------------------------
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=None, connection_type=None):
+        """httplib2.Http.request() compatible entry point"""
+
+        self.requests += 1
+        path = urllib.parse.urlparse(uri).path
+
+        if path.startswith('/batch/'):
+            return self._batch(body, headers or {})
+
+        status, content = self._call(method, uri, body)
+        return self._response(status), content
+
+# -----------------------------------------------------------------------------
+
+    def _response(self, status: int,
+                  content_type: str = 'application/json') -> httplib2.Response:
+        return httplib2.Response({'status': status,
+                                  'content-type': content_type})
+
+# -----------------------------------------------------------------------------
+
+    def _error(self, status: int, reason: str) -> tuple[int, bytes]:
+        return status, json.dumps({'error': {
+            'code': status,
+            'message': reason,
+            'errors': [{'reason': reason, 'message': reason}]
+        }}).encode()
+
+# -----------------------------------------------------------------------------
+
+    def _call(self, method: str, uri: str,
+              body: str | bytes | None) -> tuple[int, bytes]:
+        """Dispatch a single API call"""
+
+        self.calls += 1
+        if self.failures:
+            return self._error(*self.failures.pop(0))
+
+        url = urllib.parse.urlparse(uri)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        parts = url.path.rstrip('/').split('/')
+        if isinstance(body, bytes):
+            body = body.decode()
+
+        # .../calendars/<calendarId>/events[/<eventId>]
+        if parts[-1] == 'events':
+            if method == 'GET':
+                result = self._list(query)
+                if isinstance(result, tuple):
+                    return result
+                if 'fields' in query:
+                    result = _mask(result, query['fields'])
+                content = json.dumps(result).encode()
+                self.read_bytes += len(content)
+                return 200, content
+            if method == 'POST':
+                return 200, json.dumps(self._insert(json.loads(body))).encode()
+        elif parts[-2] == 'events':
+            event_id = urllib.parse.unquote(parts[-1])
+            if event_id not in self.events:
+                return self._error(404, 'notFound')
+            if method == 'GET':
+                return 200, json.dumps(self.events[event_id]).encode()
+            if method == 'PATCH':
+                self.events[event_id].update(json.loads(body))
+                self._touch(event_id)
+                return 200, json.dumps(self.events[event_id]).encode()
+            if method == 'DELETE':
+                del self.events[event_id]
+                self.cancelled[event_id] = {'id': event_id,
+                                            'status': 'cancelled'}
+                self._touch(event_id)
+                return 204, b''
+
+        return self._error(400, 'badRequest')
+
+# -----------------------------------------------------------------------------
+
+    def _insert(self, event: dict) -> dict:
+        event.setdefault('id', f'fake{next(self._ids)}')
+        event['htmlLink'] = f'https://calendar.example/{event['id']}'
+        event['status'] = 'confirmed'
+        self.events[event['id']] = event
+        self._touch(event['id'])
+        return event
+
+# -----------------------------------------------------------------------------
+
+    def _list(self, query: dict[str, str]) -> dict | tuple[int, bytes]:
+        """List events, honouring the time window, text and private property
+        search and paging"""
+
+        def naive(value: str) -> datetime:
+            return datetime.fromisoformat(value).replace(tzinfo=None)
+
+        if 'syncToken' in query:
+            return self._sync(query)
+
+        items = sorted(self.events.values(),
+                       key=lambda e: e['start'].get('dateTime', ''))
+        if 'timeMin' in query:
+            items = [e for e in items
+                     if naive(e['end']['dateTime']) > naive(query['timeMin'])]
+        if 'timeMax' in query:
+            items = [e for e in items
+                     if naive(e['start']['dateTime']) <
+                     naive(query['timeMax'])]
+        if 'privateExtendedProperty' in query:
+            name, value = query['privateExtendedProperty'].split('=', 1)
+            items = [e for e in items
+                     if e.get('extendedProperties', {}).get('private', {})
+                     .get(name) == value]
+        if 'q' in query:
+            items = [e for e in items
+                     if query['q'] in e.get('summary', '') or
+                     query['q'] in e.get('description', '')]
+
+        result = self._page(items, query)
+        if not {'timeMin', 'timeMax', 'q', 'privateExtendedProperty'} & \
+                query.keys() and 'nextPageToken' not in result:
+            result['nextSyncToken'] = str(self.seq)
+        return result
+
+# -----------------------------------------------------------------------------
+
+    def _sync(self, query: dict[str, str]) -> dict | tuple[int, bytes]:
+        """Events changed since a sync token, tokens from the future are
+        expired"""
+
+        token = int(query['syncToken'])
+        if token > self.seq:
+            return self._error(410, 'fullSyncRequired')
+
+        items = [self.events.get(event_id) or self.cancelled[event_id]
+                 for event_id, seq in sorted(self.changed.items(),
+                                             key=lambda item: item[1])
+                 if seq > token]
+        result = self._page(items, query)
+        if 'nextPageToken' not in result:
+            result['nextSyncToken'] = str(self.seq)
+        return result
+
+# -----------------------------------------------------------------------------
+
+    def _page(self, items: list[dict], query: dict[str, str]) -> dict:
+
+        page_size = min(int(query.get('maxResults', self.page_size)),
+                        self.page_size)
+        offset = int(query.get('pageToken', 0))
+        result: dict = {'kind': 'calendar#events',
+                        'items': items[offset:offset + page_size]}
+        if offset + page_size < len(items):
+            result['nextPageToken'] = str(offset + page_size)
+        return result
+
+# -----------------------------------------------------------------------------
+
+    def _batch(self, body: str, headers: dict) -> tuple[httplib2.Response,
+                                                        bytes]:
+        """Answer a multipart/mixed batch request part by part"""
+
+        message = Parser().parsestr(
+            f'content-type: {headers['content-type']}\r\n\r\n{body}')
+        boundary = f'batch_{uuid.uuid4().hex}'
+        chunks = []
+
+        for part in message.get_payload():
+            request_line, payload = part.get_payload().split('\n', 1)
+            method, path = request_line.split(' ')[:2]
+            content = payload.split('\n\n', 1)[1] if '\n\n' in payload \
+                else None
+            status, response = self._call(
+                method, 'https://www.googleapis.com' + path, content or None)
+
+            content_id = part['Content-ID'].replace('<', '<response-', 1)
+            chunks.append(
+                f'--{boundary}\r\n'
+                'Content-Type: application/http\r\n'
+                f'Content-ID: {content_id}\r\n\r\n'
+                f'HTTP/1.1 {status} OK\r\n'
+                'Content-Type: application/json\r\n\r\n'
+                f'{response.decode()}\r\n')
+
+        content = ''.join(chunks) + f'--{boundary}--\r\n'
+        return (self._response(200, f'multipart/mixed; boundary={boundary}'),
+                content.encode())
+
+
+# -----------------------------------------------------------------------------
+
+def _mask(value, fields: str):
+    """Apply a partial response fields mask such as
+    'nextPageToken,items(id,start)' to a response"""
+
+    if isinstance(value, list):
+        return [_mask(item, fields) for item in value]
+    if not isinstance(value, dict):
+        return value
+
+    masked = {}
+    depth = 0
+    start = 0
+    for i, char in enumerate(fields + ','):
+        depth += {'(': 1, ')': -1}.get(char, 0)
+        if char != ',' or depth:
+            continue
+        field = fields[start:i].strip()
+        start = i + 1
+        name, _, sub = field.partition('(')
+        if name in value:
+            masked[name] = _mask(value[name], sub[:-1]) if sub \
+                else value[name]
+
+    return masked
@@ -0,0 +1,389 @@
+# -----------------------------------------------------------------------------
+
+import asyncio
+from collections.abc import Iterable, Iterator
+import concurrent.futures
+import itertools
+import os
+import queue
+import random
+import sys
+import time
+from threading import Event, Lock, Semaphore, Thread
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cache import CACHE_DIR, PageCache
+from metrics import metrics
+from ratelimit import RateLimiter
+
+# -----------------------------------------------------------------------------
+
+# Status codes that are worth another try
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class Fetcher():
+    """Fetch pages with a pool of worker threads sharing one keep-alive
+    requests session, with per-request timeouts, retries with backoff and a
+    per-host rate limit. At most concurrency requests are in flight, over
+    all concurrent imap() calls."""
+
+    def __init__(self,
+                 concurrency: int = 3,
+                 rate: float = 0.0,
+                 timeout: float = 10.0,
+                 retries: int = 3,
+                 backoff: float = 0.5,
+                 cache: PageCache | None = None,
+                 verbose: bool = False) -> None:
+
+        self.concurrency: int = max(1, concurrency)
+        self.rate: float = rate
+        self.timeout: float = timeout
+        self.retries: int = retries
+        self.backoff: float = backoff
+        self.cache: PageCache | None = cache
+        self.verbose: bool = verbose
+        self._limiters: dict[str, RateLimiter] = {}
+        self._inflight: dict = {}
+        self._lock = Lock()
+        self._slots = Semaphore(self.concurrency)
+
+        # The connection pool holds a connection for each request slot
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4,
+                              pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+# -----------------------------------------------------------------------------
+
+    def _limiter(self, url: str) -> RateLimiter:
+        """Get the rate limiter for the host of url"""
+
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._limiters:
+                self._limiters[host] = RateLimiter(self.rate)
+            return self._limiters[host]
+
+# -----------------------------------------------------------------------------
+
+    def _delay(self, attempt: int) -> float:
+        """Exponential backoff with jitter"""
+
+        return self.backoff * 2 ** attempt * (1 + random.random())
+
+# -----------------------------------------------------------------------------
+
+    def get(self, url: str, cache: bool = True,
+            phase: str = 'fetch') -> str:
+        """HTTP GET url and return the body as text. Cached pages are
+        returned as is while fresh and revalidated when stale. Requests are
+        counted in the metrics of phase.
+
+        Concurrent gets of the same url share a single request."""
+
+        with self._lock:
+            future = self._inflight.get(url)
+            shared = future is not None
+            if not shared:
+                future = self._inflight[url] = concurrent.futures.Future()
+
+        if shared:
+            metrics.add(f'{phase} shared', calls=1)
+            return future.result()
+
+        try:
+            text = self._get(url, cache, phase)
+            future.set_result(text)
+            return text
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[url]
+
+# -----------------------------------------------------------------------------
+
+    def _get(self, url: str, cache: bool, phase: str) -> str:
+
+        entry = self.cache.get(url) if self.cache and cache else None
+        if entry and self.cache.is_fresh(entry):  # type: ignore
+            metrics.add(f'{phase} cached', calls=1)
+            return entry.body
+
+        for attempt in range(self.retries + 1):
+            self._limiter(url).acquire()
+            try:
+                start = time.perf_counter()
+                with self._slots:
+                    response = self.session.get(
+                        url, timeout=self.timeout,
+                        headers=PageCache.validators(entry))
+                metrics.add(phase, time.perf_counter() - start, 1,
+                            len(response.content))
+                if response.status_code == 304 and entry:
+                    self.cache.revalidated(entry)  # type: ignore
+                    return entry.body
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    if self.verbose:
+                        print(f'Fetched {len(response.text)} bytes from '
+                              f'page {url}')
+                    if self.cache and cache:
+                        self.cache.put(url, response.text, response.headers)
+                    return response.text
+                error: Exception = requests.HTTPError(
+                    f'{response.status_code} for {url}')
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+
+            if attempt < self.retries:
+                time.sleep(self._delay(attempt))
+
+        raise error
+
+# -----------------------------------------------------------------------------
+
+    def _get_or_none(self, url: str, cache: bool = True,
+                     phase: str = 'fetch') -> str | None:
+        try:
+            return self.get(url, cache, phase)
+        except requests.RequestException as e:
+            sys.stderr.write(f'Failed to fetch {url}: {e}\n')
+            return None
+
+# -----------------------------------------------------------------------------
+
+    def imap(self, urls: Iterable[str], cache: bool = True,
+             phase: str = 'fetch') -> Iterator[tuple[int, str | None]]:
+        """Fetch urls concurrently and yield (index, text) tuples as soon as
+        each page arrives. urls may be a lazy iterable, at most twice
+        concurrency pages are fetched ahead of the consumer."""
+
+        todo = enumerate(urls)
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.concurrency) as executor:
+
+            pending = {executor.submit(self._get_or_none, url, cache,
+                                       phase): i
+                       for i, url in itertools.islice(
+                           todo, 2 * self.concurrency)}
+
+            while pending:
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+                for i, url in itertools.islice(todo, len(done)):
+                    pending[executor.submit(
+                        self._get_or_none, url, cache, phase)] = i
+
+# -----------------------------------------------------------------------------
+
+    def close(self) -> None:
+        self.session.close()
+
+
+# -----------------------------------------------------------------------------
+
+class AsyncFetcher(Fetcher):
+    """Fetch pages with asyncio and aiohttp on a pooled keep-alive connector
+    with at most concurrency requests in flight. All imap() calls share one
+    event loop thread, its session and its connector.
+
+    Requires the optional aiohttp dependency."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError('The async engine requires aiohttp, install '
+                              'it with: pip install aiohttp')
+        self._aiohttp = aiohttp
+
+        # Started by the first imap() call
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._session = None
+        self._semaphore: asyncio.Semaphore | None = None
+
+# -----------------------------------------------------------------------------
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        """The event loop of the fetcher, started in a thread of its own"""
+
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                Thread(target=loop.run_forever, daemon=True).start()
+                asyncio.run_coroutine_threadsafe(self._open(), loop).result()
+                self._loop = loop
+            return self._loop
+
+# -----------------------------------------------------------------------------
+
+    async def _open(self) -> None:
+
+        aiohttp = self._aiohttp
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+# -----------------------------------------------------------------------------
+
+    async def _get_async(self, url: str, cache: bool = True,
+                         phase: str = 'fetch') -> str | None:
+        """HTTP GET url and return the body as text, None on failure.
+        Concurrent gets of the same url share a single request."""
+
+        task = self._inflight.get(url)
+        if task:
+            metrics.add(f'{phase} shared', calls=1)
+            return await asyncio.shield(task)
+
+        task = self._inflight[url] = asyncio.ensure_future(
+            self._fetch_async(url, cache, phase))
+        try:
+            return await task
+        finally:
+            del self._inflight[url]
+
+# -----------------------------------------------------------------------------
+
+    async def _fetch_async(self, url: str, cache: bool,
+                           phase: str) -> str | None:
+
+        aiohttp = self._aiohttp
+        error: Exception | None = None
+
+        entry = self.cache.get(url) if self.cache and cache else None
+        if entry and self.cache.is_fresh(entry):  # type: ignore
+            metrics.add(f'{phase} cached', calls=1)
+            return entry.body
+
+        for attempt in range(self.retries + 1):
+            await asyncio.sleep(self._limiter(url).reserve())
+            try:
+                start = time.perf_counter()
+                async with self._semaphore, self._session.get(  # type: ignore
+                        url, headers=PageCache.validators(entry)) as response:
+                    body = await response.read()
+                    metrics.add(phase, time.perf_counter() - start, 1,
+                                len(body))
+                    if response.status == 304 and entry:
+                        self.cache.revalidated(entry)  # type: ignore
+                        return entry.body
+                    if response.status not in RETRY_STATUS:
+                        response.raise_for_status()
+                        text = await response.text()
+                        if self.verbose:
+                            print(f'Fetched {len(text)} bytes from page '
+                                  f'{url}')
+                        if self.cache and cache:
+                            self.cache.put(url, text, response.headers)
+                        return text
+                    error = aiohttp.ClientResponseError(
+                        response.request_info, (), status=response.status)
+            except aiohttp.ClientResponseError as e:
+                error = e
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+
+            if attempt < self.retries:
+                await asyncio.sleep(self._delay(attempt))
+
+        sys.stderr.write(f'Failed to fetch {url}: {error}\n')
+        return None
+
+# -----------------------------------------------------------------------------
+
+    async def _imap(self, urls: Iterable[str], cache: bool, phase: str,
+                    results: queue.Queue, slots: Semaphore,
+                    closed: Event) -> None:
+
+        async def fetch(i: int, url: str) -> None:
+            results.put((i, await self._get_async(url, cache, phase)))
+
+        todo = enumerate(urls)
+
+        def pull() -> tuple[int, str] | None:
+            # Take a slot before the next url, the consumer frees it when it
+            # takes a page
+            slots.acquire()
+            return None if closed.is_set() else next(todo, None)
+
+        try:
+            # Pull urls from a worker thread as urls and slots may block
+            tasks: set[asyncio.Task] = set()
+            while (item := await asyncio.to_thread(pull)):
+                task = asyncio.create_task(fetch(*item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        finally:
+            results.put(None)
+
+# -----------------------------------------------------------------------------
+
+    def imap(self, urls: Iterable[str], cache: bool = True,
+             phase: str = 'fetch') -> Iterator[tuple[int, str | None]]:
+        """Fetch urls concurrently and yield (index, text) tuples as soon as
+        each page arrives. urls may be a lazy iterable, at most twice
+        concurrency pages are fetched ahead of the consumer."""
+
+        results: queue.Queue = queue.Queue()
+        slots = Semaphore(2 * self.concurrency)
+        closed = Event()
+        future = asyncio.run_coroutine_threadsafe(
+            self._imap(urls, cache, phase, results, slots, closed),
+            self._start())
+
+        try:
+            while (result := results.get()) is not None:
+                slots.release()
+                yield result
+        finally:
+            # Stop pulling urls if the consumer is gone
+            closed.set()
+            slots.release()
+
+        future.result()
+
+# -----------------------------------------------------------------------------
+
+    def close(self) -> None:
+        if self._loop:
+            asyncio.run_coroutine_threadsafe(
+                self._session.close(), self._loop).result()  # type: ignore
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+        super().close()
+
+
+# -----------------------------------------------------------------------------
+
+def make_fetcher(args) -> Fetcher:
+    """Create the fetch engine selected by the command line arguments"""
+
+    engine = AsyncFetcher if getattr(args, 'engine', 'threads') == 'async' \
+        else Fetcher
+
+    cache = None
+    if not getattr(args, 'no_cache', True):
+        cache = PageCache(directory=getattr(args, 'cache_dir', None) or
+                          os.path.join(CACHE_DIR, 'pages'),
+                          verbose=args.verbose)
+
+    return engine(concurrency=getattr(args, 'concurrency', 3),
+                  rate=getattr(args, 'rate', 0.0),
+                  cache=cache,
+                  verbose=args.verbose)
@@ -0,0 +1,342 @@
+# -----------------------------------------------------------------------------
+
+from __future__ import annotations
+import argparse
+from datetime import datetime, timezone
+import hashlib
+import http.server
+import os
+import re
+import sys
+import tempfile
+import threading
+
+from cache import CACHE_DIR
+from cinemateket import Movie, screening_key
+
+# -----------------------------------------------------------------------------
+
+ICS_FILE = os.path.join(CACHE_DIR, 'cine2cal.ics')
+
+# Screenings are local wall clock times in Stockholm
+TIMEZONE = 'Europe/Stockholm'
+
+VTIMEZONE = [
+    'BEGIN:VTIMEZONE',
+    f'TZID:{TIMEZONE}',
+    'BEGIN:DAYLIGHT',
+    'TZOFFSETFROM:+0100',
+    'TZOFFSETTO:+0200',
+    'TZNAME:CEST',
+    'DTSTART:19700329T020000',
+    'RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU',
+    'END:DAYLIGHT',
+    'BEGIN:STANDARD',
+    'TZOFFSETFROM:+0200',
+    'TZOFFSETTO:+0100',
+    'TZNAME:CET',
+    'DTSTART:19701025T030000',
+    'RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU',
+    'END:STANDARD',
+    'END:VTIMEZONE',
+]
+
+# Properties that change with every rewrite of an event and are left out
+# when comparing events
+_VOLATILE = ('DTSTAMP:', 'SEQUENCE:')
+
+
+def _escape(text: str) -> str:
+    """Escape a TEXT value"""
+
+    return text.replace('\\', '\\\\').replace(';', '\\;') \
+        .replace(',', '\\,').replace('\n', '\\n')
+
+
+def _fold(line: str) -> str:
+    """Fold a content line into lines of at most 75 octets"""
+
+    data = line.encode()
+    if len(data) <= 75:
+        return line
+
+    lines = []
+    while data:
+        # Do not split a multi-byte character
+        size = min(len(data), 75 if not lines else 74)
+        while size < len(data) and data[size] & 0xC0 == 0x80:
+            size -= 1
+        lines.append(data[:size].decode())
+        data = data[size:]
+    return '\r\n '.join(lines)
+
+
+def _time(value: datetime) -> str:
+    return f'TZID={TIMEZONE}:{value.strftime('%Y%m%dT%H%M%S')}'
+
+
+class IcsFeed():
+    """iCalendar feed of the screenings, written to a file.
+
+    Events have stable UIDs from their screening keys and the reminders of
+    the calendar events. Events of screenings that have not changed keep
+    their stamp and sequence, so subscribers only see the changed ones, and
+    the file is not rewritten at all when nothing has changed.
+    """
+
+    def __init__(self, path: str = ICS_FILE, tag: str = 'CINEMATEKET',
+                 attendees: list[str] | None = None) -> None:
+
+        self.path: str = path
+        self.tag: str = tag
+        self.attendees: list[str] = attendees or []
+
+        # Events of the file by UID, as lists of unfolded content lines
+        self.events: dict[str, list[str]] = {}
+        self._load()
+
+# -----------------------------------------------------------------------------
+
+    def _load(self) -> None:
+
+        try:
+            with open(self.path, 'r', encoding='utf-8', newline='') as stream:
+                text = stream.read()
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            sys.stderr.write(f'Failed to load calendar feed: {e}\n')
+            return
+
+        lines = re.sub(r'\r\n[ \t]', '', text).split('\r\n')
+        event: list[str] | None = None
+        for line in lines:
+            if line == 'BEGIN:VEVENT':
+                event = []
+            if event is None:
+                continue
+            event.append(line)
+            if line == 'END:VEVENT':
+                uid = next((line[4:] for line in event
+                            if line.startswith('UID:')), None)
+                if uid:
+                    self.events[uid] = event
+                event = None
+
+# -----------------------------------------------------------------------------
+
+    def uid(self, movie: Movie) -> str:
+        return f'{screening_key(movie.link, movie.start)}@cine2cal'
+
+# -----------------------------------------------------------------------------
+
+    def _build_event(self, movie: Movie, stamp: str,
+                     sequence: int) -> list[str]:
+        """Content lines of the event of a screening"""
+
+        description = _escape(f'{self.tag}:\n{movie.year}\n{movie.link}')
+        lines = [
+            'BEGIN:VEVENT',
+            f'UID:{self.uid(movie)}',
+            f'DTSTAMP:{stamp}',
+            f'SEQUENCE:{sequence}',
+            f'DTSTART;{_time(movie.start)}',
+            f'DTEND;{_time(movie.end)}',
+            f'SUMMARY:{_escape(movie.name)}',
+            f'LOCATION:{_escape(movie.theater)}',
+            f'DESCRIPTION:{description}',
+            f'URL:{movie.link}',
+        ]
+
+        # An email a day before if there is someone to send it to and a
+        # popup an hour before, as for the calendar events
+        if self.attendees:
+            lines += ['BEGIN:VALARM', 'ACTION:EMAIL', 'TRIGGER:-PT24H',
+                      f'SUMMARY:{_escape(movie.name)}',
+                      f'DESCRIPTION:{description}']
+            lines += [f'ATTENDEE:mailto:{email}' for email in self.attendees]
+            lines += ['END:VALARM']
+        lines += ['BEGIN:VALARM', 'ACTION:DISPLAY', 'TRIGGER:-PT1H',
+                  f'DESCRIPTION:{_escape(movie.name)}', 'END:VALARM',
+                  'END:VEVENT']
+
+        return lines
+
+# -----------------------------------------------------------------------------
+
+    def update(self, movies: list[Movie],
+               save: bool = True) -> dict[str, int]:
+        """Make the feed hold the events of the screenings, keeping the
+        events that have not changed as they are.
+
+        Returns:
+            numbers of added, changed, removed and unchanged events.
+        """
+
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        counts = dict.fromkeys(('added', 'changed', 'removed', 'unchanged'),
+                               0)
+        events: dict[str, list[str]] = {}
+
+        for movie in sorted(movies, key=lambda movie: movie.start):
+            uid = self.uid(movie)
+            old = self.events.get(uid)
+            sequence = 0
+            if old:
+                sequence = next((int(line[9:]) for line in old
+                                 if line.startswith('SEQUENCE:')), 0) + 1
+            event = self._build_event(movie, stamp, sequence)
+
+            if not old:
+                counts['added'] += 1
+            elif _stable(old) == _stable(event):
+                event = old
+                counts['unchanged'] += 1
+            else:
+                counts['changed'] += 1
+            events[uid] = event
+
+        counts['removed'] = len(self.events.keys() - events.keys())
+        changed = counts['added'] or counts['changed'] or counts['removed'] \
+            or list(self.events) != list(events)
+        self.events = events
+
+        if save and (changed or not os.path.exists(self.path)):
+            self.save()
+
+        return counts
+
+# -----------------------------------------------------------------------------
+
+    def save(self) -> None:
+        """Atomically write the feed to disk"""
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='') as stream:
+                for line in self._lines():
+                    stream.write(_fold(line) + '\r\n')
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+# -----------------------------------------------------------------------------
+
+    def _lines(self):
+        yield 'BEGIN:VCALENDAR'
+        yield 'VERSION:2.0'
+        yield 'PRODID:-//cine2cal//Cinemateket Stockholm//SV'
+        yield 'CALSCALE:GREGORIAN'
+        yield 'METHOD:PUBLISH'
+        yield f'X-WR-CALNAME:{self.tag.capitalize()}'
+        yield f'X-WR-TIMEZONE:{TIMEZONE}'
+        yield from VTIMEZONE
+        for event in self.events.values():
+            yield from event
+        yield 'END:VCALENDAR'
+
+
+def _stable(event: list[str]) -> list[str]:
+    return [line for line in event if not line.startswith(_VOLATILE)]
+
+
+# -----------------------------------------------------------------------------
+
+class FeedServer(http.server.ThreadingHTTPServer):
+    """Local web server for a feed file. Answers conditional requests with
+    304 Not Modified while the file is unchanged."""
+
+    daemon_threads = True
+
+    def __init__(self, path: str, port: int = 8000,
+                 host: str = '127.0.0.1') -> None:
+
+        self.path: str = path
+        self._lock = threading.Lock()
+        self._cached: tuple[tuple[int, int], bytes, str] | None = None
+
+        super().__init__((host, port), _FeedHandler)
+        self.url: str = f'http://{host}:{self.server_port}/' \
+                        f'{os.path.basename(path)}'
+
+# -----------------------------------------------------------------------------
+
+    def start(self) -> None:
+        """Serve in a background thread"""
+
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+# -----------------------------------------------------------------------------
+
+    def feed(self) -> tuple[bytes, str]:
+        """The feed and its ETag, read again once the file has changed"""
+
+        stat = os.stat(self.path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if not self._cached or self._cached[0] != version:
+                with open(self.path, 'rb') as stream:
+                    body = stream.read()
+                etag = f'"{hashlib.sha1(body).hexdigest()}"'
+                self._cached = (version, body, etag)
+            return self._cached[1], self._cached[2]
+
+
+class _FeedHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:
+        self._serve(head=False)
+
+    def do_HEAD(self) -> None:
+        self._serve(head=True)
+
+    def _serve(self, head: bool) -> None:
+        try:
+            body, etag = self.server.feed()  # type: ignore
+        except OSError:
+            self.send_error(404)
+            return
+
+        if etag in [tag.strip() for tag in
+                    self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/calendar; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+# -----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    """Serve a feed written by cine2cal.py --ics"""
+
+    parser = argparse.ArgumentParser(description='Serve a calendar feed')
+    parser.add_argument('--port', '-p', type=int, default=8000,
+                        help='Port to serve the feed on.')
+    parser.add_argument('path', nargs='?', default=ICS_FILE,
+                        help='Feed file.')
+    args = parser.parse_args()
+
+    server = FeedServer(args.path, args.port)
+    print(f'Serving {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
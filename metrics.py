@@ -0,0 +1,90 @@
+# -----------------------------------------------------------------------------
+
+from contextlib import contextmanager
+import json
+from threading import Lock
+import time
+
+# -----------------------------------------------------------------------------
+
+
+class Metrics():
+    """Thread-safe registry of per-phase durations, call counts and byte
+    counts. Durations of concurrent calls in a phase add up, so a phase may
+    report more seconds than the wall clock time of the run."""
+
+    def __init__(self) -> None:
+        self.phases: dict[str, dict[str, float]] = {}
+        self._lock = Lock()
+
+# -----------------------------------------------------------------------------
+
+    def add(self, phase: str, seconds: float = 0.0, calls: int = 0,
+            size: int = 0) -> None:
+        """Add to the counters of a phase"""
+
+        with self._lock:
+            counters = self.phases.setdefault(
+                phase, {'seconds': 0.0, 'calls': 0, 'bytes': 0})
+            counters['seconds'] += seconds
+            counters['calls'] += calls
+            counters['bytes'] += size
+
+# -----------------------------------------------------------------------------
+
+    @contextmanager
+    def timer(self, phase: str, calls: int = 0, size: int = 0):
+        """Time a block of code as part of a phase"""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start, calls, size)
+
+# -----------------------------------------------------------------------------
+
+    def reset(self) -> None:
+        with self._lock:
+            self.phases.clear()
+
+# -----------------------------------------------------------------------------
+
+    def table(self) -> str:
+        """Format all phases as a table"""
+
+        from tabulate import tabulate
+
+        with self._lock:
+            rows = [[phase, f'{c['seconds']:.3f}', c['calls'], c['bytes']]
+                    for phase, c in self.phases.items()]
+
+        return tabulate(rows, headers=['Phase', 'Seconds', 'Calls', 'Bytes'],
+                        tablefmt='simple')
+
+# -----------------------------------------------------------------------------
+
+    def json(self) -> str:
+        """Format all phases as JSON"""
+
+        with self._lock:
+            return json.dumps(self.phases, indent=2)
+
+# -----------------------------------------------------------------------------
+
+    def prometheus(self, prefix: str = 'cine2cal') -> str:
+        """Format all phases in the Prometheus text exposition format"""
+
+        lines = []
+        with self._lock:
+            for counter in ('seconds', 'calls', 'bytes'):
+                name = f'{prefix}_phase_{counter}_total'
+                lines.append(f'# TYPE {name} counter')
+                for phase, c in self.phases.items():
+                    lines.append(f'{name}{{phase="{phase}"}} {c[counter]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+# Registry shared by all modules
+metrics = Metrics()
@@ -0,0 +1,153 @@
+# -----------------------------------------------------------------------------
+
+from __future__ import annotations
+from datetime import datetime
+import json
+import os
+import sys
+import tempfile
+
+from googleapiclient.errors import HttpError
+
+from cache import CACHE_DIR
+from dcal import EVENT_FIELDS, MAX_RESULTS, CineCal
+
+# -----------------------------------------------------------------------------
+
+MIRROR_FILE = os.path.join(CACHE_DIR, 'mirror.json')
+
+# Version of the mirror file format, other versions are reloaded in full
+VERSION = 1
+
+
+class CalendarMirror():
+    """Local copy of the tagged events of a calendar, persisted on disk and
+    kept up to date with incremental syncs.
+
+    The first sync lists the whole calendar, later syncs use the sync token
+    of the previous one and only fetch the events changed since. When the
+    token has expired the calendar is listed in full again.
+    """
+
+    def __init__(self, cinecal: CineCal, path: str = MIRROR_FILE) -> None:
+
+        self.cinecal: CineCal = cinecal
+        self.path: str = path
+        self.calendar: str = cinecal.calendar_id
+        self.sync_token: str | None = None
+        self.events: dict[str, dict] = {}
+        self._load()
+
+# -----------------------------------------------------------------------------
+
+    def _load(self) -> None:
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as stream:
+                data = json.load(stream)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            sys.stderr.write(f'Failed to load calendar mirror: {e}\n')
+            return
+
+        if data.get('version') == VERSION and \
+                data.get('calendar') == self.calendar:
+            self.sync_token = data.get('sync_token')
+            self.events = data.get('events', {})
+
+# -----------------------------------------------------------------------------
+
+    def save(self) -> None:
+        """Atomically write the mirror to disk"""
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as stream:
+                json.dump({'version': VERSION,
+                           'calendar': self.calendar,
+                           'sync_token': self.sync_token,
+                           'events': self.events}, stream)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            sys.stderr.write(f'Failed to save calendar mirror: {e}\n')
+
+# -----------------------------------------------------------------------------
+
+    def sync(self) -> int:
+        """Fetch the events changed since the last sync, or all events the
+        first time and after the sync token has expired.
+
+        Returns:
+            number of changed events.
+        """
+
+        if self.sync_token:
+            try:
+                return self._sync(self.sync_token)
+            except HttpError as e:
+                if e.resp.status != 410:
+                    raise
+                if self.cinecal.verbose:
+                    print('Sync token expired, reloading the calendar')
+
+        self.events = {}
+        return self._sync(None)
+
+# -----------------------------------------------------------------------------
+
+    def _sync(self, sync_token: str | None) -> int:
+
+        page_token = None
+        changed = 0
+
+        while True:
+            result = self.cinecal._read(
+                self.cinecal.service.events().list(  # type: ignore
+                    calendarId=self.calendar,
+                    timeZone=self.cinecal.timezone,
+                    singleEvents=True,
+                    maxResults=MAX_RESULTS,
+                    fields=f'nextPageToken,nextSyncToken,'
+                           f'items({EVENT_FIELDS})',
+                    syncToken=sync_token,
+                    pageToken=page_token))
+
+            for event in result.get('items', []):
+                if event.get('status') == 'cancelled' or \
+                        not self.cinecal._is_tagged(event):
+                    changed += self.events.pop(event['id'], None) is not None
+                elif event.get('start', {}).get('dateTime'):
+                    self.events[event['id']] = event
+                    changed += 1
+
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                break
+
+        self.sync_token = result.get('nextSyncToken')
+        if self.cinecal.verbose:
+            print(f'Synced {changed} changed events, mirroring '
+                  f'{len(self.events)} tagged events')
+        self.save()
+
+        return changed
+
+# -----------------------------------------------------------------------------
+
+    def scan(self, time_min: datetime, time_max: datetime) -> list[dict]:
+        """Tagged events of the whole days time_min to time_max"""
+
+        time_min = time_min.replace(hour=0, minute=0, second=0, tzinfo=None)
+        time_max = time_max.replace(hour=23, minute=59, second=59,
+                                    tzinfo=None)
+
+        def naive(value: str) -> datetime:
+            return datetime.fromisoformat(value).replace(tzinfo=None)
+
+        return sorted((event for event in self.events.values()
+                       if naive(event['end']['dateTime']) > time_min and
+                       naive(event['start']['dateTime']) < time_max),
+                      key=lambda event: event['start']['dateTime'])
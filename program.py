@@ -0,0 +1,378 @@
+# -----------------------------------------------------------------------------
+
+from __future__ import annotations
+from collections.abc import Iterator
+from dataclasses import asdict, dataclass
+import datetime
+import json
+import os
+import sqlite3
+from threading import Event, Lock
+import time
+
+from cache import CACHE_DIR
+from cinemateket import Movie, MovieLength, Screening, screening_key
+from fetch import Fetcher
+from source import Source, print_movies
+
+# -----------------------------------------------------------------------------
+
+PROGRAM_FILE = os.path.join(CACHE_DIR, 'program.sqlite')
+
+# Orders of query results
+SORTS = {
+    'start': 'start, theater',
+    'name': 'name, start',
+    'year': 'year, start',
+    'theater': 'theater, start',
+}
+
+
+@dataclass
+class Query:
+    """Filters of a program query. Days is a number of days from today and
+    is used where no end date is given."""
+    theaters: list[str] | None = None
+    name: str | None = None
+    year_min: int | None = None
+    year_max: int | None = None
+    start: datetime.date | None = None
+    end: datetime.date | None = None
+    days: int | None = None
+    sort: str = 'start'
+
+    def span(self) -> tuple[datetime.datetime | None,
+                            datetime.datetime | None]:
+        """First and last start time of the screenings, None if open"""
+
+        start, end = self.start, self.end
+        if self.days is not None:
+            start = start or datetime.date.today()
+            end = end or datetime.date.today() + \
+                datetime.timedelta(days=self.days)
+
+        return (datetime.datetime.combine(start, datetime.time())
+                if start else None,
+                datetime.datetime.combine(end, datetime.time.max)
+                if end else None)
+
+# -----------------------------------------------------------------------------
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), default=str)
+
+# -----------------------------------------------------------------------------
+
+    @classmethod
+    def from_json(cls, text: str) -> Query:
+        query = cls(**json.loads(text))
+        for key in ('start', 'end'):
+            if getattr(query, key):
+                setattr(query, key, datetime.date.fromisoformat(
+                    getattr(query, key)))
+        return query
+
+
+class ProgramDB():
+    """Local store of the scraped program, indexed for queries by start
+    time, theater and year, and of named queries to sync from with the
+    screenings each of them has selected."""
+
+    def __init__(self, path: str = PROGRAM_FILE, keep_days: int = 365) -> None:
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path: str = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = Lock()
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS screenings (
+                link TEXT NOT NULL,
+                start TEXT NOT NULL,
+                name TEXT NOT NULL,
+                theater TEXT NOT NULL,
+                year INTEGER,
+                hours INTEGER NOT NULL,
+                minutes INTEGER NOT NULL,
+                PRIMARY KEY (link, start)
+            );
+            CREATE INDEX IF NOT EXISTS screenings_start
+                ON screenings (start);
+            CREATE INDEX IF NOT EXISTS screenings_theater
+                ON screenings (theater, start);
+            CREATE INDEX IF NOT EXISTS screenings_year
+                ON screenings (year, start);
+            CREATE TABLE IF NOT EXISTS queries (
+                name TEXT PRIMARY KEY,
+                query TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS selections (
+                query TEXT NOT NULL,
+                key TEXT NOT NULL,
+                start TEXT NOT NULL,
+                PRIMARY KEY (query, key)
+            );""")
+
+        # Forget screenings that are long gone
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=keep_days)
+        for table in ('screenings', 'selections'):
+            self.db.execute(f'DELETE FROM {table} WHERE start < ?',
+                            (cutoff.isoformat(),))
+        self.db.commit()
+
+# -----------------------------------------------------------------------------
+
+    def store(self, movies: list[Movie],
+              window: tuple[datetime.datetime, datetime.datetime],
+              unresolved: set[str] | None = None) -> None:
+        """Replace the screenings starting in the scraped time window with
+        the scraped screenings. Screenings whose movie link or screening key
+        is unresolved are kept as they are."""
+
+        unresolved = unresolved or set()
+        with self._lock, self.db:
+            rows = self.db.execute(
+                'SELECT link, start FROM screenings WHERE start BETWEEN ? '
+                'AND ?', (window[0].isoformat(),
+                          window[1].isoformat())).fetchall()
+            self.db.executemany(
+                'DELETE FROM screenings WHERE link = ? AND start = ?',
+                [(row['link'], row['start']) for row in rows
+                 if row['link'] not in unresolved and screening_key(
+                     row['link'], datetime.datetime.fromisoformat(
+                         row['start'])) not in unresolved])
+            self.db.executemany(
+                'INSERT OR REPLACE INTO screenings VALUES '
+                '(?, ?, ?, ?, ?, ?, ?)',
+                [(movie.link, movie.start.isoformat(), movie.name,
+                  movie.theater,
+                  int(movie.year) if movie.year.isdigit() else None,
+                  movie.length.hours, movie.length.minutes)
+                 for movie in movies])
+
+# -----------------------------------------------------------------------------
+
+    def query(self, query: Query, limit: int = 0) -> list[Movie]:
+        """Screenings matching a query, all of them if limit is 0"""
+
+        clauses, params = [], []
+        first, last = query.span()
+        if first:
+            clauses.append('start >= ?')
+            params.append(first.isoformat())
+        if last:
+            clauses.append('start <= ?')
+            params.append(last.isoformat())
+        if query.theaters:
+            clauses.append(
+                f'theater IN ({', '.join('?' * len(query.theaters))})')
+            params += query.theaters
+        if query.year_min is not None:
+            clauses.append('year >= ?')
+            params.append(query.year_min)
+        if query.year_max is not None:
+            clauses.append('year <= ?')
+            params.append(query.year_max)
+        if query.name:
+            clauses.append('name LIKE ?')
+            params.append(f'%{query.name}%')
+
+        sql = 'SELECT * FROM screenings'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += f' ORDER BY {SORTS[query.sort]}'
+        if limit:
+            sql += f' LIMIT {int(limit)}'
+
+        with self._lock:
+            rows = self.db.execute(sql, params).fetchall()
+
+        return [Screening.create(
+            name=row['name'],
+            link=row['link'],
+            start=datetime.datetime.fromisoformat(row['start']),
+            theater=row['theater'],
+            year=str(row['year']) if row['year'] is not None else '-',
+            length=MovieLength(hours=row['hours'], minutes=row['minutes']))
+            for row in rows]
+
+# -----------------------------------------------------------------------------
+
+    def save_query(self, name: str, query: Query) -> None:
+        with self._lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO queries VALUES (?, ?)',
+                            (name, query.to_json()))
+
+# -----------------------------------------------------------------------------
+
+    def load_query(self, name: str) -> Query:
+        """Get a named query
+
+        Raises:
+            Exception: If there is no query by that name
+        """
+
+        with self._lock:
+            row = self.db.execute('SELECT query FROM queries WHERE name = ?',
+                                  (name,)).fetchone()
+        if not row:
+            raise Exception(f'No stored query named {name} in {self.path}')
+
+        return Query.from_json(row['query'])
+
+# -----------------------------------------------------------------------------
+
+    def keys(self, first: datetime.datetime,
+             last: datetime.datetime) -> set[str]:
+        """Screening keys of the screenings starting between first and
+        last"""
+
+        with self._lock:
+            rows = self.db.execute(
+                'SELECT link, start FROM screenings WHERE start BETWEEN ? '
+                'AND ?', (first.isoformat(), last.isoformat())).fetchall()
+
+        return {screening_key(row['link'],
+                              datetime.datetime.fromisoformat(row['start']))
+                for row in rows}
+
+# -----------------------------------------------------------------------------
+
+    def select(self, name: str, movies: list[Movie]) -> None:
+        """Record screenings as selected by the named query"""
+
+        with self._lock, self.db:
+            self.db.executemany(
+                'INSERT OR IGNORE INTO selections VALUES (?, ?, ?)',
+                [(name, screening_key(movie.link, movie.start),
+                  movie.start.isoformat()) for movie in movies])
+
+# -----------------------------------------------------------------------------
+
+    def selected(self, name: str) -> dict[str, datetime.datetime]:
+        """Start times of the screenings the named query has selected, by
+        screening key"""
+
+        with self._lock:
+            rows = self.db.execute(
+                'SELECT key, start FROM selections WHERE query = ?',
+                (name,)).fetchall()
+
+        return {row['key']: datetime.datetime.fromisoformat(row['start'])
+                for row in rows}
+
+# -----------------------------------------------------------------------------
+
+    def close(self) -> None:
+        self.db.close()
+
+
+# -----------------------------------------------------------------------------
+
+class ProgramSource(Source):
+    """The screenings of a stored query, or of the whole program database,
+    read without network access"""
+
+    name = 'program'
+
+    def __init__(self, args, fetcher: Fetcher | None = None,
+                 state=None, lazy: bool = False,
+                 stop: Event | None = None) -> None:
+
+        self.db = ProgramDB(getattr(args, 'program', None) or PROGRAM_FILE)
+        self.query_name: str | None = getattr(args, 'query', None)
+        self.query: Query = self.db.load_query(self.query_name) \
+            if self.query_name else Query()
+
+        # Dry runs leave the selections of the query as they are
+        self.dry_run: bool = getattr(args, 'dry_run', False)
+
+        super().__init__(args, fetcher=fetcher, state=state, lazy=lazy,
+                         stop=stop)
+
+# -----------------------------------------------------------------------------
+
+    def iter_movies(self, max_movies: int | None = None) -> Iterator[Movie]:
+        """Get the screenings of the query, all of them as the query is the
+        selection. The window is the time span of the query, as far as it
+        is bounded, or else of the screenings it selects now and has
+        selected before.
+
+        The calendar may hold the events of other syncs. Only the events
+        of screenings the query has selected on some run, or that are gone
+        from the program, are deleted. The keys of the other screenings in
+        the window go in self.unresolved so that their events are kept."""
+
+        movies = self.db.query(self.query)
+        selected = self.db.selected(self.query_name) \
+            if self.query_name else {}
+        starts = [movie.start for movie in movies] + list(selected.values())
+        if starts:
+            first, last = self.query.span()
+            self.window = (first or min(starts), last or max(starts))
+
+        if self.query_name and self.window:
+            if not self.dry_run:
+                self.db.select(self.query_name, movies)
+            self.unresolved |= self.db.keys(*self.window) - \
+                selected.keys() - {screening_key(movie.link, movie.start)
+                                   for movie in movies}
+
+        for movie in movies:
+            self.movies.append(movie)
+            yield movie
+
+        self.movies.sort(key=lambda movie: movie.start)
+
+# -----------------------------------------------------------------------------
+
+
+if __name__ == '__main__':
+    """Query the program database, without network access"""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='program')
+    parser.add_argument('--days', '-d', type=int, default=None,
+                        help='Screenings from today and this many days on.')
+    parser.add_argument('--end', '-e', type=datetime.date.fromisoformat,
+                        default=None,
+                        help='Screenings up to this date (YYYY-MM-DD).')
+    parser.add_argument('--limit', '-l', type=int, default=0,
+                        help='Number of screenings to show, 0 for all.')
+    parser.add_argument('--name', '-n', type=str, default=None,
+                        help='Screenings of films with this in their name.')
+    parser.add_argument('--program', type=str, default=PROGRAM_FILE,
+                        help='Program database.')
+    parser.add_argument('--query', '-q', type=str, default=None,
+                        help='Run the stored query of this name.')
+    parser.add_argument('--save', type=str, default=None,
+                        help='Store the query under this name, for '
+                             'cine2cal.py --query.')
+    parser.add_argument('--sort', choices=list(SORTS), default='start',
+                        help='Order of the screenings.')
+    parser.add_argument('--start', '-s', type=datetime.date.fromisoformat,
+                        default=None,
+                        help='Screenings from this date (YYYY-MM-DD).')
+    parser.add_argument('--theater', '-t', action='append', default=None,
+                        help='Screenings at this theater, may be repeated.')
+    parser.add_argument('--year-max', type=int, default=None,
+                        help='Films made this year or earlier.')
+    parser.add_argument('--year-min', type=int, default=None,
+                        help='Films made this year or later.')
+    args = parser.parse_args()
+
+    db = ProgramDB(args.program)
+    query = db.load_query(args.query) if args.query else Query(
+        theaters=args.theater, name=args.name, year_min=args.year_min,
+        year_max=args.year_max, start=args.start, end=args.end,
+        days=args.days, sort=args.sort)
+    if args.save:
+        db.save_query(args.save, query)
+
+    start = time.perf_counter()
+    movies = db.query(query, args.limit)
+    elapsed = time.perf_counter() - start
+
+    print_movies(movies)
+    print(f'{len(movies)} screenings in {elapsed * 1000:.1f} ms')
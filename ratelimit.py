@@ -0,0 +1,64 @@
+# -----------------------------------------------------------------------------
+
+from threading import Lock
+import time
+
+# -----------------------------------------------------------------------------
+
+
+class RateLimiter():
+    """Thread-safe token bucket allowing rate requests per second with bursts
+    of up to burst requests. A rate of 0 disables limiting."""
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate: float = rate
+        self.max_rate: float = rate
+        self.burst: int = burst
+        self._tokens: float = burst
+        self._last: float = time.monotonic()
+        self._lock = Lock()
+
+# -----------------------------------------------------------------------------
+
+    def reserve(self) -> float:
+        """Take a token and return the number of seconds to wait before it
+        may be used. Async callers sleep on this themselves."""
+
+        if self.rate <= 0:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+
+            return max(0.0, -self._tokens / self.rate)
+
+# -----------------------------------------------------------------------------
+
+    def acquire(self) -> None:
+        """Block until a token is available"""
+
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+# -----------------------------------------------------------------------------
+
+    def slow_down(self) -> None:
+        """Halve the rate after the server has throttled a request, down to
+        a sixteenth of the configured rate"""
+
+        with self._lock:
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+
+# -----------------------------------------------------------------------------
+
+    def speed_up(self) -> None:
+        """Raise the rate by a hundredth of the configured rate after a
+        request went through, up to the configured rate"""
+
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
@@ -0,0 +1,233 @@
+# -----------------------------------------------------------------------------
+
+from __future__ import annotations
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+from cinemateket import Movie
+from state import SyncState
+
+if TYPE_CHECKING:
+    from dcal import CineCal
+
+# -----------------------------------------------------------------------------
+
+
+@dataclass
+class Plan:
+    """Calendar changes that bring the tagged events in line with the
+    scraped screenings"""
+    inserts: list[Movie] = field(default_factory=list)
+    patches: list[tuple[dict, Movie, list[str]]] = field(default_factory=list)
+    deletes: list[dict] = field(default_factory=list)
+    unchanged: list[tuple[dict, Movie]] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.inserts) + len(self.patches) + len(self.deletes)
+
+# -----------------------------------------------------------------------------
+
+    def print(self) -> None:
+        """Print the changes in a formatted table"""
+
+        from tabulate import tabulate
+
+        rows = [['insert', movie.start.strftime('%Y-%m-%d %H:%M'),
+                 movie.name, movie.theater, '']
+                for movie in self.inserts]
+        rows += [['patch', movie.start.strftime('%Y-%m-%d %H:%M'),
+                  movie.name, movie.theater, ', '.join(fields)]
+                 for _, movie, fields in self.patches]
+        rows += [['delete', _start(event).strftime('%Y-%m-%d %H:%M'),
+                  event.get('summary', ''), event.get('location', ''), '']
+                 for event in self.deletes]
+
+        print(tabulate(rows, headers=['Action', 'Time', 'Movie', 'Theater',
+                                      'Fields'], tablefmt='simple'))
+        print(f'{len(self.inserts)} to insert, {len(self.patches)} to patch, '
+              f'{len(self.deletes)} to delete and {len(self.unchanged)} '
+              'unchanged events.')
+
+
+# -----------------------------------------------------------------------------
+
+def _start(event: dict) -> datetime:
+    """Start of an event as local wall clock time"""
+
+    return datetime.fromisoformat(
+        event['start']['dateTime']).replace(tzinfo=None)
+
+
+class Reconciler():
+    """Match scraped screenings to the tagged events in the calendar and
+    plan the minimal set of inserts, patches and deletes.
+
+    A screening matches the event with its screening key, or for events
+    that predate the keys, the event with the same start and title. A
+    screening without one takes over an unmatched event of the same movie,
+    so that a moved screening is patched instead of duplicated. Unmatched
+    events in the scraped time window and duplicate events are deleted,
+    except for the events of movies the scrape could not resolve.
+    """
+
+    def __init__(self, cinecal: CineCal,
+                 state: SyncState | None = None) -> None:
+
+        self.cinecal: CineCal = cinecal
+        self.state: SyncState | None = state
+        self.plan: Plan = Plan()
+
+        # Indexed events not matched to a screening yet by event id, their
+        # ids by screening key, by (start, title) and by movie link, and
+        # duplicates
+        self.events: dict[str, dict] = {}
+        self.keys: dict[str, str] = {}
+        self.titles: dict[tuple[datetime, str], str] = {}
+        self.links: dict[str, set[str]] = {}
+        self.duplicates: list[dict] = []
+
+        # Ids of all indexed events, an event that runs past midnight is
+        # listed again when the next day is indexed
+        self.indexed: set[str] = set()
+
+        # Screenings that wait for the end of the scrape to be matched by
+        # movie link
+        self.pending: list[Movie] = []
+
+# -----------------------------------------------------------------------------
+
+    def index(self, time_min: datetime, time_max: datetime) -> None:
+        """Add the tagged events of whole days time_min to time_max"""
+
+        for event in self.cinecal.scan(time_min, time_max):
+            if event['id'] in self.indexed:
+                continue
+            self.indexed.add(event['id'])
+
+            key = self.cinecal.private(event).get('screening')
+            title = self.cinecal.event_key(_start(event),
+                                           event.get('summary', ''))
+            if key in self.keys or (not key and title in self.titles):
+                self.duplicates.append(event)
+                continue
+
+            self.events[event['id']] = event
+            if key:
+                self.keys[key] = event['id']
+            self.titles.setdefault(title, event['id'])
+            self.links.setdefault(self.cinecal.event_link(event),
+                                  set()).add(event['id'])
+
+# -----------------------------------------------------------------------------
+
+    def _pop(self, event_id: str | None) -> dict | None:
+        event = self.events.pop(event_id, None) if event_id else None
+        if event:
+            self.links[self.cinecal.event_link(event)].discard(event_id)
+        return event
+
+# -----------------------------------------------------------------------------
+
+    def add(self, movie: Movie) -> None:
+        """Plan the sync of a screening. Its days must have been indexed."""
+
+        event = self._pop(self.keys.get(
+            self.cinecal.screening_key(movie.link, movie.start))) or \
+            self._pop(self.titles.get(
+                self.cinecal.event_key(movie.start, movie.name)))
+        if event:
+            self._compare(event, movie)
+        elif self.links.get(movie.link):
+            self.pending.append(movie)
+        else:
+            self.plan.inserts.append(movie)
+
+# -----------------------------------------------------------------------------
+
+    def _compare(self, event: dict, movie: Movie) -> None:
+        """Plan a patch of the event fields that differ from the screening"""
+
+        wanted = self.cinecal._build_event(movie)
+        fields = [key for key in ('summary', 'location', 'description')
+                  if event.get(key, '') != wanted[key]]
+        fields += [key for key in ('start', 'end')
+                   if datetime.fromisoformat(event[key]['dateTime'])
+                   .replace(tzinfo=None) != getattr(movie, key)]
+        private = self.cinecal.private(event)
+        if any(private.get(key) != value for key, value in
+               wanted['extendedProperties']['private'].items()):
+            fields.append('extendedProperties')
+
+        if fields:
+            self.plan.patches.append((event, movie, fields))
+        else:
+            self.plan.unchanged.append((event, movie))
+
+# -----------------------------------------------------------------------------
+
+    def finish(self, time_min: datetime, time_max: datetime,
+               unresolved: set[str] | None = None) -> None:
+        """Plan the screenings left for the end of the scrape. Each takes
+        over the nearest unmatched event of its movie or is inserted. The
+        remaining unmatched events starting between time_min and time_max
+        and all duplicates are deleted. Unmatched events of the movie links
+        and screening keys in unresolved are kept, their screenings are
+        missing from the scrape but not from the program."""
+
+        for movie in self.pending:
+            same = [(abs(_start(self.events[event_id]) - movie.start),
+                     event_id)
+                    for event_id in self.links.get(movie.link, ())]
+            if same:
+                self._compare(self._pop(min(same)[1]), movie)  # type: ignore
+            else:
+                self.plan.inserts.append(movie)
+        self.pending = []
+
+        unresolved = unresolved or set()
+        for event_id, event in list(self.events.items()):
+            if time_min <= _start(event) <= time_max and \
+                    self.cinecal.event_link(event) not in unresolved and \
+                    self.cinecal.private(event).get('screening') \
+                    not in unresolved:
+                self.plan.deletes.append(self._pop(event_id))  # type: ignore
+
+        self.plan.deletes += self.duplicates
+        self.duplicates = []
+
+# -----------------------------------------------------------------------------
+
+    def take(self) -> Plan:
+        """Get the changes planned so far and start a new plan"""
+
+        plan, self.plan = self.plan, Plan()
+        return plan
+
+# -----------------------------------------------------------------------------
+
+    def apply(self, plan: Plan) -> None:
+        """Make the changes of a plan in the calendar and record the synced
+        screenings in the state store"""
+
+        for (event, movie, _), updated in zip(
+                plan.patches, self.cinecal.patch_many(
+                    [(event['id'], movie) for event, movie, _ in plan.patches],
+                    [fields for _, _, fields in plan.patches])):
+            if updated and self.state:
+                self.state.remove_event(event['id'])
+                self.state.add(movie, event['id'])
+
+        created = self.cinecal.insert_many(plan.inserts) \
+            if plan.inserts else []
+
+        self.cinecal.delete_many([event['id'] for event in plan.deletes])
+
+        if self.state:
+            for event, movie in plan.unchanged:
+                self.state.add(movie, event['id'])
+            for movie, event in zip(plan.inserts, created):
+                if event:
+                    self.state.add(movie, event['id'])
+            for event in plan.deletes:
+                self.state.remove_event(event['id'])
@@ -0,0 +1,231 @@
+# -----------------------------------------------------------------------------
+
+from __future__ import annotations
+from collections.abc import Iterator
+import datetime
+import importlib
+import queue
+import sys
+from threading import Event, Thread
+from typing import TYPE_CHECKING
+
+from fetch import Fetcher, make_fetcher
+
+if TYPE_CHECKING:
+    from cinemateket import Movie
+
+# -----------------------------------------------------------------------------
+
+# Source plugins by name, as module.Class. Sources not listed here can be
+# given as module.Class directly.
+SOURCES = {
+    'cinemateket': 'cinemateket.Cinemateket',
+    'program': 'program.ProgramSource',
+}
+
+
+class Source():
+    """A program of screenings scraped from a web site.
+
+    Plugins subclass Source and implement iter_movies(), which yields each
+    screening as soon as it is known, adds it to self.movies and keeps
+    self.window covering every screening yielded. Movie links, or screening
+    keys, of screenings in the program that could not be resolved go in
+    self.unresolved, their calendar events are kept. Sources share the
+    fetch engine, its connection pool and its per-host rate limits.
+    """
+
+    name = ''
+
+    def __init__(self, args, fetcher: Fetcher | None = None,
+                 state=None, lazy: bool = False,
+                 stop: Event | None = None) -> None:
+
+        self.movies: list[Movie] = []
+        self.max_movies: int = args.movies
+        self.until: datetime.date | None = getattr(args, 'until', None)
+        self.window: tuple[datetime.datetime, datetime.datetime] | None = None
+        self.unresolved: set[str] = set()
+        self.verbose: bool = args.verbose
+        self.fetcher: Fetcher = fetcher or make_fetcher(args)
+
+        # Already synced screenings are taken from the state store instead
+        # of being fetched again
+        self.state = state
+
+        # The scrape ends early once stop is set
+        self.stop: Event | None = stop
+
+        # Lazy instances import nothing until iter_movies() is consumed
+        if not lazy:
+            self._import_movies(self.max_movies)
+
+# -----------------------------------------------------------------------------
+
+    def iter_movies(self, max_movies: int | None = None) -> Iterator[Movie]:
+        """Get movies and yield each one as soon as it is known"""
+
+        raise NotImplementedError
+
+# -----------------------------------------------------------------------------
+
+    def _import_movies(self, max_movies: int) -> int:
+        """Get movies and store them in the instance's movie list"""
+
+        # A spinner to indicate progress, halo is only loaded for terminals
+        spinner = None
+        if sys.stdout.isatty():
+            from halo import Halo
+            spinner = Halo(text='Fetching movies.', spinner='moon')
+            spinner.start()
+
+        for _ in self.iter_movies(max_movies):
+            pass
+
+        if spinner:
+            spinner.stop_and_persist(
+                symbol=u'\N{check mark}',
+                text=f'Fetched {len(self.movies)} movies.')
+        return len(self.movies)
+
+# -----------------------------------------------------------------------------
+
+    def count(self) -> int:
+        return len(self.movies)
+
+# -----------------------------------------------------------------------------
+
+    def list(self) -> list[Movie]:
+        return self.movies
+
+# -----------------------------------------------------------------------------
+
+    def pop(self) -> Movie:
+        return self.movies.pop()
+
+# -----------------------------------------------------------------------------
+
+    def print(self) -> None:
+        """Print all movies in a formatted table"""
+
+        print_movies(self.movies)
+
+# -----------------------------------------------------------------------------
+
+
+class MultiSource(Source):
+    """Several sources scraped concurrently into one program. The window is
+    the span of the windows of all sources."""
+
+    def __init__(self, args, sources: list[type[Source]],
+                 fetcher: Fetcher | None = None, state=None,
+                 lazy: bool = False, stop: Event | None = None) -> None:
+
+        fetcher = fetcher or make_fetcher(args)
+        self.queue_size: int = getattr(args, 'queue_size', 64)
+        self.sources: list[Source] = [
+            source(args, fetcher=fetcher, state=state, lazy=True, stop=stop)
+            for source in sources]
+        super().__init__(args, fetcher=fetcher, state=state, lazy=lazy,
+                         stop=stop)
+
+# -----------------------------------------------------------------------------
+
+    def iter_movies(self, max_movies: int | None = None) -> Iterator[Movie]:
+        """Get the movies of all sources, each source in a thread of its
+        own, and yield them as they arrive"""
+
+        movies: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        errors: list[Exception] = []
+
+        def produce(source: Source) -> None:
+            try:
+                for movie in source.iter_movies(max_movies):
+                    movies.put(movie)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                movies.put(None)
+
+        for source in self.sources:
+            Thread(target=produce, args=(source,), daemon=True).start()
+
+        running = len(self.sources)
+        while running:
+            movie = movies.get()
+            if movie is None:
+                running -= 1
+                continue
+
+            windows = [source.window for source in self.sources
+                       if source.window]
+            self.window = (min(first for first, _ in windows),
+                           max(last for _, last in windows))
+            self.movies.append(movie)
+            yield movie
+
+        for source in self.sources:
+            self.unresolved |= source.unresolved
+
+        # The program of a failed source is incomplete, syncing it would
+        # delete the events of its missing screenings
+        if errors:
+            raise errors[0]
+
+        self.movies.sort(key=lambda movie: movie.start)
+
+# -----------------------------------------------------------------------------
+
+
+def print_movies(movies: list[Movie]) -> None:
+    """Print movies in a formatted table"""
+
+    from tabulate import tabulate
+
+    table_data = [
+        [
+            f'{movie.start.strftime('%Y-%m-%d %H:%M')}',
+            movie.name,
+            movie.year,
+            movie.theater,
+            f'{movie.length.hours}h {movie.length.minutes}m'
+        ]
+        for movie in movies
+    ]
+
+    headers = ['Time', 'Movie', 'Year', 'Theater', 'Length']
+    print(tabulate(table_data, headers=headers, tablefmt='simple'))
+
+# -----------------------------------------------------------------------------
+
+
+def load_source(name: str) -> type[Source]:
+    """The source plugin class of a name or module.Class"""
+
+    path = SOURCES.get(name, name)
+    module, _, cls = path.rpartition('.')
+    if not module:
+        raise Exception(f'Unknown source {name}')
+
+    source = getattr(importlib.import_module(module), cls, None)
+    if not (isinstance(source, type) and issubclass(source, Source)):
+        raise Exception(f'{path} is not a source')
+
+    return source
+
+# -----------------------------------------------------------------------------
+
+
+def make_source(args, fetcher: Fetcher | None = None, state=None,
+                lazy: bool = False, stop: Event | None = None) -> Source:
+    """The source of the --source plugins, all of them scraped concurrently
+    if there are several"""
+
+    sources = [load_source(name) for name in dict.fromkeys(
+        getattr(args, 'source', None) or ['cinemateket'])]
+    if len(sources) == 1:
+        return sources[0](args, fetcher=fetcher, state=state, lazy=lazy,
+                          stop=stop)
+
+    return MultiSource(args, sources, fetcher=fetcher, state=state,
+                       lazy=lazy, stop=stop)
@@ -0,0 +1,106 @@
+# -----------------------------------------------------------------------------
+
+import datetime
+import os
+import sqlite3
+from threading import Lock
+
+from cache import CACHE_DIR
+from cinemateket import Movie, MovieLength, Screening
+
+# -----------------------------------------------------------------------------
+
+STATE_FILE = os.path.join(CACHE_DIR, 'state.sqlite')
+
+
+class SyncState():
+    """Local store of screenings already synced to the calendar and their
+    calendar event ids, keyed by movie link and start time."""
+
+    def __init__(self, path: str = STATE_FILE, keep_days: int = 30) -> None:
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path: str = path
+        # The scraper and the calendar sync may run in separate threads
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = Lock()
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS screenings (
+                link TEXT NOT NULL,
+                start TEXT NOT NULL,
+                end TEXT NOT NULL,
+                name TEXT NOT NULL,
+                theater TEXT NOT NULL,
+                year TEXT NOT NULL,
+                hours INTEGER NOT NULL,
+                minutes INTEGER NOT NULL,
+                event_id TEXT,
+                PRIMARY KEY (link, start)
+            )""")
+
+        # Forget screenings that are long gone
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=keep_days)
+        self.db.execute('DELETE FROM screenings WHERE start < ?',
+                        (cutoff.isoformat(),))
+        self.db.commit()
+
+# -----------------------------------------------------------------------------
+
+    @staticmethod
+    def _movie(row: sqlite3.Row) -> Movie:
+        return Screening.create(
+            name=row['name'],
+            link=row['link'],
+            start=datetime.datetime.fromisoformat(row['start']),
+            theater=row['theater'],
+            year=row['year'],
+            length=MovieLength(hours=row['hours'], minutes=row['minutes']))
+
+# -----------------------------------------------------------------------------
+
+    def movie(self, link: str, start: datetime.datetime,
+              theater: str) -> Movie | None:
+        """Get an already synced screening, None if it is unknown or the
+        theater has changed."""
+
+        with self._lock:
+            row = self.db.execute(
+                'SELECT * FROM screenings WHERE link = ? AND start = ? '
+                'AND theater = ?',
+                (link, start.isoformat(), theater)).fetchone()
+
+        return self._movie(row) if row else None
+
+# -----------------------------------------------------------------------------
+
+    def add(self, movie: Movie, event_id: str | None) -> None:
+        """Record a screening as synced to calendar event event_id"""
+
+        with self._lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO screenings VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (movie.link, movie.start.isoformat(), movie.end.isoformat(),
+                 movie.name, movie.theater, movie.year, movie.length.hours,
+                 movie.length.minutes, event_id))
+
+# -----------------------------------------------------------------------------
+
+    def remove_event(self, event_id: str) -> None:
+        """Forget the screening synced to calendar event event_id"""
+
+        with self._lock:
+            self.db.execute('DELETE FROM screenings WHERE event_id = ?',
+                            (event_id,))
+
+# -----------------------------------------------------------------------------
+
+    def commit(self) -> None:
+        with self._lock:
+            self.db.commit()
+
+# -----------------------------------------------------------------------------
+
+    def close(self) -> None:
+        self.db.close()
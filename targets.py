@@ -0,0 +1,80 @@
+# -----------------------------------------------------------------------------
+
+from __future__ import annotations
+from dataclasses import dataclass, field
+import json
+import os
+from typing import TYPE_CHECKING
+
+from cinemateket import Movie
+from state import SyncState
+
+if TYPE_CHECKING:
+    from dcal import CineCal
+
+# -----------------------------------------------------------------------------
+
+
+@dataclass
+class Target:
+    """A calendar the program is synced to. Targets without theaters get
+    every screening and targets without a rate use --calendar-rate. The
+    calendar connection and the sync state of a target are kept between
+    runs."""
+    name: str = ''
+    calendar: str = 'primary'
+    attendees: list[str] | None = None
+    theaters: list[str] | None = None
+    rate: float | None = None
+
+    cinecal: CineCal | None = field(default=None, init=False, repr=False)
+    state: SyncState | None = field(default=None, init=False, repr=False)
+
+# -----------------------------------------------------------------------------
+
+    def path(self, path: str) -> str:
+        """The file of this target for the shared file path, named after
+        the target"""
+
+        if not self.name:
+            return path
+
+        root, ext = os.path.splitext(path)
+        return f'{root}-{self.name}{ext}'
+
+# -----------------------------------------------------------------------------
+
+    def wants(self, movie: Movie) -> bool:
+        """Check if a screening goes into this calendar"""
+
+        return not self.theaters or movie.theater in self.theaters
+
+# -----------------------------------------------------------------------------
+
+
+def load_targets(path: str) -> list[Target]:
+    """Load the calendar targets of a JSON config file:
+
+    {"targets": [{"name": "victor",
+                  "calendar": "...@group.calendar.google.com",
+                  "attendees": ["..."],
+                  "theaters": ["Bio Victor"],
+                  "rate": 5}]}
+
+    Raises:
+        Exception: If the file is not a valid config
+    """
+
+    with open(path, 'r', encoding='utf-8') as stream:
+        config = json.load(stream)
+
+    try:
+        targets = [Target(**target) for target in config['targets']]
+    except (KeyError, TypeError) as e:
+        raise Exception(f'Invalid targets in {path}: {e}') from e
+
+    names = [target.name for target in targets]
+    if not targets or '' in names or len(set(names)) != len(names):
+        raise Exception(f'Targets in {path} need unique names')
+
+    return targets
@@ -0,0 +1,114 @@
+# -----------------------------------------------------------------------------
+
+import argparse
+import datetime
+import os
+import types
+
+import pytest
+import requests
+
+import cinemateket
+import program
+from cinemateket import Cinemateket
+from dcal import CineCal
+from fakecal import FakeCalendarHttp
+from fetch import Fetcher
+
+# -----------------------------------------------------------------------------
+
+PAGES = os.path.join(os.path.dirname(__file__), '..', 'fixtures', 'pages')
+PROGRAM = '/sv/se-och-samtala-om-film/cinemateket-stockholm/program/2025/'
+
+
+def _page(name: str) -> str:
+    with open(os.path.join(PAGES, f'{name}.html'), 'r',
+              encoding='utf-8') as stream:
+        return stream.read()
+
+
+class SavedPages(Fetcher):
+    """Serve the saved pages, the program as its first index page and the
+    movie pages by their slug. The pages named in missing are not found.
+    The requested urls are kept in urls."""
+
+    def __init__(self, missing=(), **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.missing: set[str] = set(missing)
+        self.urls: list[str] = []
+
+    def _get(self, url: str, cache: bool, phase: str) -> str:
+        self.urls.append(url)
+        if url.endswith('&page=1'):
+            return _page('program')
+        if PROGRAM in url:
+            name = url.rstrip('/').rsplit('/', 1)[1]
+            if name not in self.missing and \
+                    os.path.exists(os.path.join(PAGES, f'{name}.html')):
+                return _page(name)
+        raise requests.HTTPError(f'404 for {url}')
+
+
+class _Now(datetime.datetime):
+    """The day the program was saved"""
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2025, 10, 17, 12, 0)
+
+# -----------------------------------------------------------------------------
+
+
+@pytest.fixture
+def page():
+    """Read a saved page by name"""
+
+    return _page
+
+# -----------------------------------------------------------------------------
+
+
+@pytest.fixture
+def calendar() -> FakeCalendarHttp:
+    return FakeCalendarHttp()
+
+
+@pytest.fixture
+def cinecal(calendar: FakeCalendarHttp) -> CineCal:
+    """A calendar on the fake API, without rate limits"""
+
+    return CineCal(argparse.Namespace(verbose=False, calendar_rate=0.0),
+                   http=calendar)
+
+# -----------------------------------------------------------------------------
+
+
+@pytest.fixture
+def scrape(monkeypatch):
+    """Scrape the saved program on the day it was saved, without the movie
+    pages named in missing"""
+
+    monkeypatch.setattr(cinemateket, 'datetime', types.SimpleNamespace(
+        datetime=_Now, date=datetime.date, timedelta=datetime.timedelta))
+
+    def scrape(missing=()) -> Cinemateket:
+        args = argparse.Namespace(movies=0, pages=3, parse_workers=0,
+                                  until=None, verbose=False)
+        return Cinemateket(args, fetcher=SavedPages(missing, rate=0.0,
+                                                    retries=0))
+
+    return scrape
+
+# -----------------------------------------------------------------------------
+
+
+@pytest.fixture
+def program_file(tmp_path, monkeypatch) -> str:
+    """Path of an empty program database that keeps the screenings of the
+    day the program was saved"""
+
+    monkeypatch.setattr(program, 'datetime', types.SimpleNamespace(
+        datetime=_Now, date=datetime.date, time=datetime.time,
+        timedelta=datetime.timedelta))
+
+    return str(tmp_path / 'program.sqlite')
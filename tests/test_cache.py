@@ -0,0 +1,113 @@
+# -----------------------------------------------------------------------------
+
+import os
+import time
+
+import pytest
+import requests
+
+from cache import PageCache
+from fetch import Fetcher
+
+# -----------------------------------------------------------------------------
+
+URL = 'https://www.filminstitutet.se/sv/film/persona/'
+MODIFIED = 'Fri, 17 Oct 2025 10:00:00 GMT'
+
+
+def _response(status: int, body: str = '', **headers) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content = body.encode()
+    response.encoding = 'utf-8'
+    response.headers.update({key.replace('_', '-'): value
+                             for key, value in headers.items()})
+    return response
+
+
+class _Session():
+    """Answer gets with the given responses and keep their headers"""
+
+    def __init__(self, *responses: requests.Response) -> None:
+        self.responses: list[requests.Response] = list(responses)
+        self.headers: list[dict] = []
+
+    def get(self, url: str, timeout=None, headers=None) -> requests.Response:
+        self.headers.append(headers or {})
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def cache(tmp_path) -> PageCache:
+    return PageCache(directory=str(tmp_path), ttl=60)
+
+
+def _age(cache: PageCache, url: str, seconds: float) -> None:
+    """Make the cached page of url older"""
+
+    entry = cache.get(url)
+    entry.fetched -= seconds  # type: ignore
+    cache._write(entry)  # type: ignore
+
+
+def _fetcher(cache: PageCache, *responses: requests.Response) -> Fetcher:
+    fetcher = Fetcher(cache=cache, retries=0)
+    fetcher.session = _Session(*responses)  # type: ignore
+    return fetcher
+
+# -----------------------------------------------------------------------------
+
+
+def test_fresh_page(cache):
+    fetcher = _fetcher(cache, _response(200, 'v1', ETag='"1"'))
+
+    assert fetcher.get(URL) == 'v1'
+    assert fetcher.get(URL) == 'v1'
+    assert fetcher.session.headers == [{}]
+
+# -----------------------------------------------------------------------------
+
+
+def test_not_modified(cache):
+    fetcher = _fetcher(cache, _response(200, 'v1', ETag='"1"',
+                                        Last_Modified=MODIFIED),
+                       _response(304))
+    fetcher.get(URL)
+    _age(cache, URL, 120)
+
+    assert fetcher.get(URL) == 'v1'
+    assert fetcher.session.headers[1] == {'If-None-Match': '"1"',
+                                          'If-Modified-Since': MODIFIED}
+    assert cache.is_fresh(cache.get(URL))  # type: ignore
+
+# -----------------------------------------------------------------------------
+
+
+def test_modified(cache):
+    fetcher = _fetcher(cache, _response(200, 'v1', ETag='"1"'),
+                       _response(200, 'v2', ETag='"2"'))
+    fetcher.get(URL)
+    _age(cache, URL, 120)
+
+    assert fetcher.get(URL) == 'v2'
+    assert cache.get(URL).etag == '"2"'  # type: ignore
+
+# -----------------------------------------------------------------------------
+
+
+def test_prune(cache):
+    for i in range(4):
+        cache.put(f'{URL}{i}', 'x' * 1000, {})
+    paths = [cache._path(f'{URL}{i}') for i in range(4)]
+    old = time.time() - 3600
+    for i, path in enumerate(paths):
+        os.utime(path, (old + i, old + i))
+
+    # The entry unused for too long goes first, then the least recently
+    # used entries above max_size
+    cache.expire = 3600 - 0.5
+    cache.max_size = sum(os.path.getsize(path) for path in paths[2:])
+
+    assert cache.prune() == 2
+    assert [os.path.exists(path) for path in paths] == \
+        [False, False, True, True]
@@ -0,0 +1,177 @@
+# -----------------------------------------------------------------------------
+
+import argparse
+import datetime
+import time
+
+from googleapiclient.errors import HttpError
+import httplib2
+import pytest
+
+from cinemateket import MovieLength, Screening
+from dcal import CineCal, MAX_BACKOFF
+from metrics import metrics
+
+# -----------------------------------------------------------------------------
+
+LINK = 'http://www.filminstitutet.se/sv/film/'
+
+
+def _movies(count: int, start: datetime.datetime) -> list[Screening]:
+    """Screenings of count films, a day apart from start"""
+
+    return [Screening.create(name=f'Film {i}', link=f'{LINK}{i}/',
+                             start=start + datetime.timedelta(days=i),
+                             theater='Bio Victor', year='1966',
+                             length=MovieLength(hours=1, minutes=30))
+            for i in range(count)]
+
+
+@pytest.fixture
+def sleeps(monkeypatch) -> list[float]:
+    """Backoff delays, recorded instead of slept"""
+
+    delays: list[float] = []
+    monkeypatch.setattr(time, 'sleep', delays.append)
+    return delays
+
+# -----------------------------------------------------------------------------
+
+
+def test_insert_many_batches(cinecal, calendar):
+    cinecal.batch_size = 2
+    movies = _movies(5, datetime.datetime(2025, 10, 18, 18, 0))
+
+    created = cinecal.insert_many(movies)
+
+    assert calendar.requests == 3 and calendar.calls == 5
+    assert [event['summary'] for event in created] == \
+        [movie.name for movie in movies]  # type: ignore
+    assert len(calendar.events) == 5
+    assert cinecal.stats == {'inserted': 5, 'updated': 0, 'deleted': 0,
+                             'failed': 0}
+
+# -----------------------------------------------------------------------------
+
+
+def test_insert_many_partial_failure(cinecal, calendar, sleeps):
+    movies = _movies(3, datetime.datetime(2025, 10, 18, 18, 0))
+    calendar.fail(400, reason='badRequest')
+
+    created = cinecal.insert_many(movies)
+
+    assert created[0] is None and all(created[1:])
+    assert len(calendar.events) == 2 and not sleeps
+    assert cinecal.stats['inserted'] == 2 and cinecal.stats['failed'] == 1
+
+# -----------------------------------------------------------------------------
+
+
+def test_throttled_batch_retried(cinecal, calendar, sleeps):
+    movies = _movies(3, datetime.datetime(2025, 10, 18, 18, 0))
+    calendar.fail(429, count=2)
+
+    created = cinecal.insert_many(movies)
+
+    assert all(created) and len(calendar.events) == 3
+    assert calendar.requests == 2 and len(sleeps) == 1
+    assert cinecal.stats['inserted'] == 3 and cinecal.stats['failed'] == 0
+
+# -----------------------------------------------------------------------------
+
+
+def test_delete_many(cinecal, calendar, sleeps):
+    created = cinecal.insert_many(
+        _movies(3, datetime.datetime(2025, 10, 18, 18, 0)))
+    ids = [event['id'] for event in created]  # type: ignore
+    calendar.fail(403, reason='forbidden')
+
+    # Events that are already gone count as deleted
+    deleted = cinecal.delete_many(ids + ['gone'])
+
+    assert deleted == 3 and list(calendar.events) == ids[:1]
+    assert cinecal.stats['deleted'] == 3 and cinecal.stats['failed'] == 1
+
+# -----------------------------------------------------------------------------
+
+
+def test_delete_days(cinecal, calendar):
+    now = datetime.datetime.now().replace(microsecond=0)
+    yesterday = (now - datetime.timedelta(days=1)).isoformat()
+    cinecal.insert_many(_movies(2, now - datetime.timedelta(hours=36)) +
+                        _movies(1, now + datetime.timedelta(days=1)))
+    calendar._insert({'summary': 'Untagged', 'description': 'Other',
+                      'start': {'dateTime': yesterday},
+                      'end': {'dateTime': yesterday}})
+
+    # Only the tagged events of the past two days are deleted
+    assert cinecal.delete_days(-2) == 2
+    assert sorted(event['summary'] for event in calendar.events.values()) \
+        == ['Film 0', 'Untagged']
+    assert cinecal.stats['deleted'] == 2
+
+# -----------------------------------------------------------------------------
+
+
+def test_backoff():
+    error = HttpError(httplib2.Response({'status': 429, 'retry-after': '7'}),
+                      b'')
+    assert CineCal._backoff(0, error) == 7.0
+
+    error = HttpError(httplib2.Response({'status': 503}), b'')
+    assert 0.5 <= CineCal._backoff(0, error) <= 1.0
+    assert 4.0 <= CineCal._backoff(3, error) <= 8.0
+    assert CineCal._backoff(10, error) <= MAX_BACKOFF
+
+# -----------------------------------------------------------------------------
+
+
+def test_execute_retries(calendar, sleeps):
+    cinecal = CineCal(argparse.Namespace(verbose=False, calendar_rate=10.0),
+                      http=calendar)
+    event = cinecal.insert_many(
+        _movies(1, datetime.datetime(2025, 10, 18, 18, 0)))[0]
+    metrics.reset()
+    calendar.fail(503, reason='backendError')
+    calendar.fail(429)
+
+    cinecal.delete(event['id'])  # type: ignore
+
+    assert not calendar.events and len(sleeps) == 2
+    assert 0.5 <= sleeps[0] <= 1.0 and 1.0 <= sleeps[1] <= 2.0
+    assert metrics.phases['calendar retried']['calls'] == 2
+    assert metrics.phases['calendar throttled']['calls'] == 1
+    assert cinecal.limiter.rate < 10.0
+
+# -----------------------------------------------------------------------------
+
+
+def test_execute_gives_up(cinecal, calendar, sleeps):
+    calendar.fail(403, reason='forbidden')
+    with pytest.raises(HttpError):
+        cinecal.find(_movies(1, datetime.datetime(2025, 10, 18, 18, 0))[0])
+    assert not sleeps
+
+    cinecal.retries = 2
+    calendar.fail(500, count=3, reason='backendError')
+    with pytest.raises(HttpError):
+        cinecal.find(_movies(1, datetime.datetime(2025, 10, 18, 18, 0))[0])
+    assert len(sleeps) == 2
+
+# -----------------------------------------------------------------------------
+
+
+def test_insert_recovers(cinecal, calendar, sleeps):
+    movies = _movies(2, datetime.datetime(2025, 10, 18, 18, 0))
+    created = cinecal.insert_many(movies)
+
+    # The inserts went through but their responses were lost, the events
+    # are looked up instead of inserted again
+    calendar.fail(503, reason='backendError')
+    assert cinecal.insert_many(movies[:1])[0]['id'] == \
+        created[0]['id']  # type: ignore
+    calendar.fail(503, reason='backendError')
+    cinecal.insert(movies[1])
+
+    assert len(calendar.events) == 2 and not sleeps
+    assert cinecal.stats['inserted'] == 4 and cinecal.stats['failed'] == 0
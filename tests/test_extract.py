@@ -0,0 +1,71 @@
+# -----------------------------------------------------------------------------
+
+import datetime
+
+from cinemateket import Cinemateket, MovieLength
+import extract
+
+# -----------------------------------------------------------------------------
+
+PROGRAM = '/sv/se-och-samtala-om-film/cinemateket-stockholm/program/2025/'
+
+# The screenings of the program page as the BeautifulSoup parser read them
+# before extract.py: name, link, start, theater, year and length. Articles
+# without a plain name and films without a movie page are left out.
+EXPECTED = [
+    ('Persona', f'{PROGRAM}persona/',
+     datetime.datetime(2025, 10, 18, 17, 0), 'Bio Victor', '1966',
+     MovieLength(hours=1, minutes=25)),
+    ('Det sjunde inseglet', f'{PROGRAM}det-sjunde-inseglet/',
+     datetime.datetime(2025, 10, 18, 19, 30), 'Bio Mauritz', '1957',
+     MovieLength(hours=1, minutes=36)),
+    ('Persona', f'{PROGRAM}persona/',
+     datetime.datetime(2025, 10, 21, 18, 0), 'Bio Victor', '1966',
+     MovieLength(hours=1, minutes=25)),
+    ('En kvinnas ansikte - restaurerad version', f'{PROGRAM}kvinnans-ansikte/',
+     datetime.datetime(2025, 10, 22, 20, 0), 'Bio Mauritz', '1938',
+     MovieLength(hours=0, minutes=100)),
+    ('Filmsamtal: Att restaurera ett arv',
+     f'{PROGRAM}filmsamtal-om-restaurering/',
+     datetime.datetime(2025, 10, 23, 18, 30), 'Bio Victor', '-',
+     MovieLength(hours=0, minutes=0)),
+    ('Nattvardsgästerna', f'{PROGRAM}nattvardsgasterna/',
+     datetime.datetime(2026, 1, 2, 18, 0), 'Bio Victor', '-',
+     MovieLength(hours=0, minutes=0)),
+]
+
+
+def test_articles(page):
+    names = [article[0] for article in extract.articles(page('program'))]
+
+    assert names == ['Persona', 'Det sjunde inseglet', None, 'Persona',
+                     'En kvinnas ansikte – restaurerad version',
+                     'Filmsamtal: Att restaurera ett arv',
+                     'Nattvardsgästerna', 'Sommaren med Monika']
+
+# -----------------------------------------------------------------------------
+
+
+def test_movie(page):
+    details = {name: extract.movie(page(name))[1:]
+               for name in ('persona', 'det-sjunde-inseglet',
+                            'kvinnans-ansikte', 'filmsamtal-om-restaurering',
+                            'nattvardsgasterna')}
+
+    assert details == {'persona': ('1966', 1, 25),
+                       'det-sjunde-inseglet': ('1957', 1, 36),
+                       'kvinnans-ansikte': ('1938', 0, 100),
+                       'filmsamtal-om-restaurering': ('-', 0, 0),
+                       'nattvardsgasterna': ('-', 0, 0)}
+    assert extract.movie(page('sommaren-med-monika')) is None
+
+# -----------------------------------------------------------------------------
+
+
+def test_program(scrape):
+    source = scrape()
+
+    assert [(movie.name, movie.link, movie.start, movie.theater, movie.year,
+             movie.length) for movie in source.list()] == \
+        [(name, Cinemateket.site + link, start, theater, year, length)
+         for name, link, start, theater, year, length in EXPECTED]
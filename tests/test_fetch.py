@@ -0,0 +1,102 @@
+# -----------------------------------------------------------------------------
+
+from threading import Event, Thread
+import time
+
+import pytest
+import requests
+
+from fetch import Fetcher
+from metrics import metrics
+
+# -----------------------------------------------------------------------------
+
+URL = 'https://www.filminstitutet.se/sv/film/persona/'
+
+
+class _Slow(Fetcher):
+    """Answer each url after release is set, with the url or an error"""
+
+    def __init__(self, error: bool = False, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.error: bool = error
+        self.release = Event()
+        self.urls: list[str] = []
+
+    def _get(self, url: str, cache: bool, phase: str) -> str:
+        self.urls.append(url)
+        self.release.wait(5)
+        if self.error:
+            raise requests.HTTPError(f'404 for {url}')
+        return url
+
+
+def _get_concurrently(fetcher: _Slow, count: int) -> list:
+    """Get URL from count threads at once and return what each got"""
+
+    results: list = [None] * count
+
+    def get(i: int) -> None:
+        try:
+            results[i] = fetcher.get(URL)
+        except requests.HTTPError as e:
+            results[i] = e
+
+    threads = [Thread(target=get, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+
+    # Let the followers join the request in flight before it completes
+    deadline = time.monotonic() + 5
+    while metrics.phases.get('fetch shared', {}).get('calls', 0) < \
+            count - 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    fetcher.release.set()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+@pytest.fixture(autouse=True)
+def _metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+# -----------------------------------------------------------------------------
+
+
+def test_single_flight():
+    fetcher = _Slow()
+
+    results = _get_concurrently(fetcher, 4)
+
+    assert results == [URL] * 4 and fetcher.urls == [URL]
+    assert metrics.phases['fetch shared']['calls'] == 3
+
+    # Later gets fetch again
+    assert fetcher.get(URL) == URL and fetcher.urls == [URL] * 2
+
+# -----------------------------------------------------------------------------
+
+
+def test_single_flight_error():
+    fetcher = _Slow(error=True)
+
+    results = _get_concurrently(fetcher, 3)
+
+    assert all(isinstance(result, requests.HTTPError) for result in results)
+    assert fetcher.urls == [URL] and not fetcher._inflight
+
+# -----------------------------------------------------------------------------
+
+
+def test_film_fetched_once(scrape):
+    source = scrape()
+    movies = source.list()
+
+    # Persona is screened twice, its page is fetched once
+    persona = [movie.link for movie in movies if movie.name == 'Persona']
+    assert len(persona) == 2
+    assert source.fetcher.urls.count(persona[0]) == 1
@@ -0,0 +1,100 @@
+# -----------------------------------------------------------------------------
+
+import datetime
+
+import pytest
+import requests
+
+from cinemateket import MovieLength, Screening
+from ics import FeedServer, IcsFeed
+
+# -----------------------------------------------------------------------------
+
+LINK = 'http://www.filminstitutet.se/sv/film/'
+
+
+def _movie(film: int, day: int, theater: str = 'Bio Victor') -> Screening:
+    return Screening.create(name=f'Film {film}', link=f'{LINK}{film}/',
+                            start=datetime.datetime(2025, 10, day, 18, 0),
+                            theater=theater, year='1966',
+                            length=MovieLength(hours=1, minutes=30))
+
+
+def _property(event: list[str], name: str) -> str:
+    return next(line.split(':', 1)[1] for line in event
+                if line.startswith(f'{name}:'))
+
+
+@pytest.fixture
+def path(tmp_path) -> str:
+    return str(tmp_path / 'cinemateket.ics')
+
+
+@pytest.fixture
+def program() -> list[Screening]:
+    return [_movie(1, 18), _movie(2, 19), _movie(3, 20)]
+
+# -----------------------------------------------------------------------------
+
+
+def test_stable_uids(path, program):
+    IcsFeed(path).update(program)
+    with open(path, 'rb') as stream:
+        text = stream.read()
+
+    # The feed read back from disk has the same events and is not written
+    # again while the screenings are the same
+    feed = IcsFeed(path)
+    assert list(feed.events) == [feed.uid(movie) for movie in program]
+    assert feed.update(program) == {'added': 0, 'changed': 0, 'removed': 0,
+                                    'unchanged': 3}
+    with open(path, 'rb') as stream:
+        assert stream.read() == text
+    assert all(len(line) <= 75 for line in text.split(b'\r\n'))
+
+# -----------------------------------------------------------------------------
+
+
+def test_changed_events(path, program):
+    feed = IcsFeed(path)
+    feed.update(program)
+    events = dict(feed.events)
+
+    program[1] = _movie(2, 19, theater='Bio Mauritz')
+    counts = IcsFeed(path).update(program[1:] + [_movie(4, 21)])
+
+    assert counts == {'added': 1, 'changed': 1, 'removed': 1, 'unchanged': 1}
+    feed = IcsFeed(path)
+    changed = feed.events[feed.uid(program[1])]
+    assert _property(changed, 'SEQUENCE') == '1'
+    assert _property(changed, 'LOCATION') == 'Bio Mauritz'
+    assert feed.events[feed.uid(program[2])] == events[feed.uid(program[2])]
+    assert feed.uid(program[0]) not in feed.events
+
+# -----------------------------------------------------------------------------
+
+
+def test_feed_server(path, program):
+    feed = IcsFeed(path)
+    feed.update(program)
+    server = FeedServer(path, port=0)
+    server.start()
+    try:
+        response = requests.get(server.url, timeout=5)
+        etag = response.headers['ETag']
+        assert response.status_code == 200
+        assert response.content.startswith(b'BEGIN:VCALENDAR')
+
+        response = requests.get(server.url, timeout=5,
+                                headers={'If-None-Match': etag})
+        assert response.status_code == 304 and not response.content
+
+        # A changed feed gets a new ETag
+        feed.update(program[:2])
+        response = requests.get(server.url, timeout=5,
+                                headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,76 @@
+# -----------------------------------------------------------------------------
+
+import datetime
+
+import pytest
+
+from cinemateket import MovieLength, Screening
+from mirror import CalendarMirror
+
+# -----------------------------------------------------------------------------
+
+LINK = 'http://www.filminstitutet.se/sv/film/'
+START = datetime.datetime(2025, 10, 18, 18, 0)
+
+
+def _movies(count: int) -> list[Screening]:
+    """Screenings of count films, a day apart"""
+
+    return [Screening.create(name=f'Film {i}', link=f'{LINK}{i}/',
+                             start=START + datetime.timedelta(days=i),
+                             theater='Bio Victor', year='1966',
+                             length=MovieLength(hours=1, minutes=30))
+            for i in range(count)]
+
+
+@pytest.fixture
+def path(tmp_path) -> str:
+    return str(tmp_path / 'mirror.json')
+
+
+def _summaries(mirror: CalendarMirror) -> list[str]:
+    return sorted(event['summary'] for event in mirror.events.values())
+
+# -----------------------------------------------------------------------------
+
+
+def test_incremental_sync(cinecal, calendar, path):
+    created = cinecal.insert_many(_movies(3))
+    calendar._insert({'summary': 'Untagged', 'description': 'Other',
+                      'start': {'dateTime': START.isoformat()},
+                      'end': {'dateTime': START.isoformat()}})
+    mirror = CalendarMirror(cinecal, path)
+    calendar.read_bytes = 0
+    assert mirror.sync() == 3 and mirror.sync_token
+    full = calendar.read_bytes
+
+    # Only the changes since the last sync are listed
+    cinecal.delete_many([created[0]['id']])  # type: ignore
+    cinecal.insert_many(_movies(4)[3:])
+    calendar.read_bytes = 0
+    assert mirror.sync() == 2
+    assert calendar.read_bytes < full / 2
+    assert _summaries(mirror) == ['Film 1', 'Film 2', 'Film 3']
+
+    # The mirror is read back from disk
+    mirror = CalendarMirror(cinecal, path)
+    assert mirror.sync() == 0
+    assert _summaries(mirror) == ['Film 1', 'Film 2', 'Film 3']
+    assert mirror.scan(START, START + datetime.timedelta(days=1)) == \
+        cinecal.scan(START, START + datetime.timedelta(days=1))
+
+# -----------------------------------------------------------------------------
+
+
+def test_expired_sync_token(cinecal, calendar, path):
+    created = cinecal.insert_many(_movies(3))
+    mirror = CalendarMirror(cinecal, path)
+    mirror.sync()
+    cinecal.delete_many([created[0]['id']])  # type: ignore
+
+    # The API answers an expired token with 410 Gone, the calendar is
+    # listed in full again
+    mirror.sync_token = str(calendar.seq + 1)
+    assert mirror.sync() == 2
+    assert _summaries(mirror) == ['Film 1', 'Film 2']
+    assert mirror.sync_token == str(calendar.seq)
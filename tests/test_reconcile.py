@@ -0,0 +1,212 @@
+# -----------------------------------------------------------------------------
+
+import argparse
+import datetime
+
+import pytest
+
+from cinemateket import MovieLength, Screening
+from dcal import CineCal
+from fakecal import FakeCalendarHttp
+from program import ProgramDB, ProgramSource, Query
+from reconcile import Plan, Reconciler
+
+# -----------------------------------------------------------------------------
+
+LINK = 'http://www.filminstitutet.se/sv/film/'
+
+
+def _movie(film: int, day: int, hour: int, theater: str = 'Bio Victor',
+           year: str = '1966') -> Screening:
+    return Screening.create(name=f'Film {film}', link=f'{LINK}{film}/',
+                            start=datetime.datetime(2025, 10, day, hour, 0),
+                            theater=theater, year=year,
+                            length=MovieLength(hours=1, minutes=30))
+
+
+def _sync(cinecal: CineCal, movies: list[Screening],
+          unresolved: set[str] | None = None,
+          window: tuple[datetime.datetime, datetime.datetime] | None = None
+          ) -> Plan:
+    """Sync the screenings as cine2cal.py does and return the plan"""
+
+    window = window or (min(movie.start for movie in movies),
+                        max(movie.start for movie in movies))
+    reconciler = Reconciler(cinecal)
+    reconciler.index(*window)
+    for movie in movies:
+        reconciler.add(movie)
+    reconciler.finish(*window, unresolved)
+
+    plan = reconciler.take()
+    reconciler.apply(plan)
+    return plan
+
+
+def _events(calendar: FakeCalendarHttp) -> list[tuple[str, str, str]]:
+    return sorted((event['start']['dateTime'][:16], event['summary'],
+                   event['location']) for event in calendar.events.values())
+
+
+@pytest.fixture
+def program() -> list[Screening]:
+    return [_movie(1, 18, 17), _movie(2, 18, 19), _movie(1, 21, 18)]
+
+# -----------------------------------------------------------------------------
+
+
+def test_unchanged(cinecal, calendar, program):
+    _sync(cinecal, program)
+    events = dict(calendar.events)
+
+    plan = _sync(cinecal, program)
+
+    assert len(plan) == 0 and len(plan.unchanged) == 3
+    assert calendar.events == events
+
+# -----------------------------------------------------------------------------
+
+
+def test_patched_fields(cinecal, calendar, program):
+    _sync(cinecal, program)
+    ids = set(calendar.events)
+
+    program[1] = _movie(2, 18, 19, theater='Bio Mauritz', year='1957')
+    plan = _sync(cinecal, program)
+
+    assert [fields for _, _, fields in plan.patches] == \
+        [['location', 'description']]
+    assert not plan.inserts and not plan.deletes
+    assert set(calendar.events) == ids
+    assert ('2025-10-18T19:00', 'Film 2', 'Bio Mauritz') in _events(calendar)
+
+# -----------------------------------------------------------------------------
+
+
+def test_moved_screening(cinecal, calendar, program):
+    _sync(cinecal, program)
+    ids = set(calendar.events)
+
+    program[2] = _movie(1, 21, 20)
+    plan = _sync(cinecal, program)
+
+    assert [fields for _, _, fields in plan.patches] == \
+        [['start', 'end', 'extendedProperties']]
+    assert not plan.inserts and not plan.deletes
+    assert set(calendar.events) == ids
+    assert ('2025-10-21T20:00', 'Film 1', 'Bio Victor') in _events(calendar)
+
+# -----------------------------------------------------------------------------
+
+
+def test_duplicate_keyed_event(cinecal, calendar, program):
+    cinecal.insert_many(program + program[:1])
+    assert len(calendar.events) == 4
+
+    plan = _sync(cinecal, program)
+
+    assert len(plan.deletes) == 1 and len(plan.unchanged) == 3
+    assert len(calendar.events) == 3
+    assert len(set(_events(calendar))) == 3
+
+# -----------------------------------------------------------------------------
+
+
+def test_legacy_unkeyed_event(cinecal, calendar, program):
+    _sync(cinecal, program)
+    event = next(iter(calendar.events.values()))
+    del event['extendedProperties']['private']['screening']
+
+    plan = _sync(cinecal, program)
+
+    assert [(event['id'], fields) for event, _, fields in plan.patches] == \
+        [(event['id'], ['extendedProperties'])]
+    assert not plan.inserts and not plan.deletes
+    assert cinecal.private(calendar.events[event['id']])['screening']
+
+# -----------------------------------------------------------------------------
+
+
+def test_removed_screening(cinecal, calendar, program):
+    _sync(cinecal, program)
+
+    plan = _sync(cinecal, program[:2], window=(program[0].start,
+                                               program[2].start))
+
+    assert [event['summary'] for event in plan.deletes] == ['Film 1']
+    assert len(calendar.events) == 2
+
+# -----------------------------------------------------------------------------
+
+
+def test_failed_detail_page(cinecal, calendar, scrape):
+    source = scrape()
+    _sync(cinecal, source.list(), window=source.window)
+    events = dict(calendar.events)
+    assert len(events) == 6
+
+    # Both screenings of Persona are missing when its page fails, their
+    # events are kept
+    source = scrape(missing={'persona'})
+    persona = f'{source.site}/sv/se-och-samtala-om-film/' \
+              'cinemateket-stockholm/program/2025/persona/'
+    assert len(source.list()) == 4 and persona in source.unresolved
+
+    plan = _sync(cinecal, source.list(), source.unresolved, source.window)
+
+    assert len(plan) == 0
+    assert calendar.events == events
+
+# -----------------------------------------------------------------------------
+
+
+def _query_sync(cinecal: CineCal, path: str, name: str) -> Plan:
+    """Sync the screenings of a stored query as cine2cal.py --query does"""
+
+    source = ProgramSource(argparse.Namespace(
+        movies=0, verbose=False, program=path, query=name))
+    return _sync(cinecal, source.list(), source.unresolved, source.window)
+
+
+def test_query_sync(cinecal, calendar, program, program_file):
+    db = ProgramDB(program_file)
+    program.append(_movie(3, 20, 18, theater='Bio Mauritz'))
+    db.store(program, (program[0].start, program[2].start))
+    db.save_query('victor', Query(theaters=['Bio Victor']))
+
+    # The events of a full sync in the same calendar are kept
+    _sync(cinecal, program)
+    assert len(_query_sync(cinecal, program_file, 'victor')) == 0
+    assert len(calendar.events) == 4
+
+    # The screenings the query no longer selects are deleted
+    db.save_query('victor', Query(theaters=['Bio Victor'], name='Film 2'))
+    plan = _query_sync(cinecal, program_file, 'victor')
+
+    assert sorted(event['summary'] for event in plan.deletes) == \
+        ['Film 1', 'Film 1']
+    assert [summary for _, summary, _ in _events(calendar)] == \
+        ['Film 2', 'Film 3']
+
+# -----------------------------------------------------------------------------
+
+
+def test_query_failed_detail_page(cinecal, calendar, scrape, program_file):
+    db = ProgramDB(program_file)
+    db.save_query('all', Query())
+    source = scrape()
+    db.store(source.list(), source.window, source.unresolved)
+    _query_sync(cinecal, program_file, 'all')
+    events = dict(calendar.events)
+    assert len(events) == 6
+
+    # The screenings of Persona stay in the program database when its page
+    # fails, and so do their events
+    source = scrape(missing={'persona'})
+    db.store(source.list(), source.window, source.unresolved)
+    assert len(db.query(Query())) == 6
+
+    plan = _query_sync(cinecal, program_file, 'all')
+
+    assert len(plan) == 0
+    assert calendar.events == events